@@ -0,0 +1,16 @@
+from fastapi import Request
+
+from services.document_processor import DocumentProcessor
+from services.query_engine import QueryEngine
+from services.vector_store import VectorStore
+
+# Services are created once in the application lifespan (see main.py)
+
+def get_document_processor(request: Request) -> DocumentProcessor:
+    return request.app.state.document_processor
+
+def get_query_engine(request: Request) -> QueryEngine:
+    return request.app.state.query_engine
+
+def get_vector_store(request: Request) -> VectorStore:
+    return request.app.state.vector_store
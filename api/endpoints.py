@@ -1,15 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, status
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Response, UploadFile, File, status
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import AsyncIterator, List, Optional
+from cachetools import TTLCache
 import logging
+import orjson
+import os
+import tempfile
 import time
 from datetime import datetime
 
-from database import get_db
+from database import AsyncSessionLocal, get_async_db
 from models.pydantic_models import (
     QueryRequest,
     QueryResponse,
+    BatchQueryRequest,
+    BatchQueryResponse,
     DocumentUploadResponse,
     DocumentListResponse,
     DocumentSummaryResponse,
@@ -21,24 +28,43 @@ from models.database_models import Document, DocumentChunk
 from services.document_processor import DocumentProcessor
 from services.query_engine import QueryEngine
 from services.vector_store import VectorStore
+from services.counters import get_counts
+from api.dependencies import get_document_processor, get_query_engine, get_vector_store
 from config import settings
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Initialize services
-document_processor = DocumentProcessor()
-query_engine = QueryEngine()
-vector_store = VectorStore()
+# Cached health status shared across probes
+_health_cache = TTLCache(maxsize=1, ttl=settings.HEALTH_CACHE_TTL)
+
+# Leading bytes expected for binary upload formats
+_MAGIC = {
+    b"%PDF": ".pdf",
+    b"PK\x03\x04": ".docx",  # DOCX is a ZIP container
+}
+
+def _matches_magic(extension: str, file_head: bytes) -> bool:
+    """Check that the leading bytes of an upload agree with its extension"""
+    detected = _MAGIC.get(file_head[:4])
+    if extension == ".txt":
+        # Plain text has no signature, but must not be a known binary format
+        return detected is None
+    return detected == extension
 
 @router.post("/upload", response_model=DocumentUploadResponse)
 async def upload_document(
     file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    document_processor: DocumentProcessor = Depends(get_document_processor),
+    query_engine: QueryEngine = Depends(get_query_engine),
+    vector_store: VectorStore = Depends(get_vector_store)
 ):
     """Upload and process a document"""
     start_time = time.time()
+    max_file_size = settings.MAX_FILE_SIZE
+    read_size = settings.UPLOAD_READ_SIZE
     
     try:
         # Validate file
@@ -48,34 +74,54 @@ async def upload_document(
                 detail="No file provided"
             )
         
-        # Check file size
-        file_content = await file.read()
-        if len(file_content) > settings.MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                detail=f"File size exceeds maximum allowed size of {settings.MAX_FILE_SIZE} bytes"
-            )
-        
         # Check file type
-        file_extension = file.filename.split('.')[-1].lower()
-        if f".{file_extension}" not in settings.ALLOWED_FILE_TYPES:
+        file_extension = os.path.splitext(file.filename)[1].lower()
+        if file_extension not in settings.ALLOWED_FILE_TYPES:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"File type not supported. Allowed types: {settings.ALLOWED_FILE_TYPES}"
+                detail=f"File type not supported. Allowed types: {sorted(settings.ALLOWED_FILE_TYPES)}"
             )
         
-        # Process document
-        document = await document_processor.process_document(
-            file_content=file_content,
-            filename=file.filename,
-            content_type=file.content_type or "application/octet-stream",
-            db=db
-        )
+        with tempfile.SpooledTemporaryFile(max_size=settings.UPLOAD_SPOOL_SIZE) as buffer:
+            # Stream the upload, enforcing the size limit incrementally
+            file_size = 0
+            while chunk := await file.read(read_size):
+                # Reject spoofed extensions before reading the rest of the upload
+                if file_size == 0 and not _matches_magic(file_extension, chunk):
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"File content does not match its {file_extension} extension"
+                    )
+                file_size += len(chunk)
+                if file_size > max_file_size:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=f"File size exceeds maximum allowed size of {max_file_size} bytes"
+                    )
+                buffer.write(chunk)
+            buffer.seek(0)
+            
+            # Process document
+            document, chunks = await document_processor.process_document(
+                file_stream=buffer,
+                filename=file.filename,
+                content_type=file.content_type or "application/octet-stream",
+                db=db
+            )
         
         # Add chunks to vector store
-        chunks = db.query(DocumentChunk).filter(DocumentChunk.document_id == document.id).all()
+        document_id = document.id
         if chunks:
-            await vector_store.add_document_chunks(chunks, db)
+            try:
+                await vector_store.add_document_chunks(chunks, db)
+            except Exception:
+                # A document without embeddings can never be found, so undo the
+                # upload rather than leave it behind for a retry to duplicate.
+                # The failed insert rolled back, expiring the loaded document
+                await vector_store.remove_document_chunks(document_id, db)
+                await document_processor.delete_document(document_id, db)
+                raise
+        query_engine.invalidate_document(document.id)
         
         processing_time = time.time() - start_time
         
@@ -99,7 +145,9 @@ async def upload_document(
 @router.post("/query", response_model=QueryResponse)
 async def query_documents(
     query_request: QueryRequest,
-    db: Session = Depends(get_db)
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
+    query_engine: QueryEngine = Depends(get_query_engine)
 ):
     """Query documents using natural language"""
     try:
@@ -111,8 +159,9 @@ async def query_documents(
             )
         
         # Process query
-        response = await query_engine.process_query(query_request, db)
-        return response
+        query_response = await query_engine.process_query(query_request, db)
+        response.headers["Cache-Control"] = f"max-age={settings.QUERY_CACHE_TTL}"
+        return query_response
         
     except HTTPException:
         raise
@@ -123,34 +172,68 @@ async def query_documents(
             detail=f"Error processing query: {str(e)}"
         )
 
+@router.post("/query/batch", response_model=BatchQueryResponse)
+async def query_documents_batch(
+    batch_request: BatchQueryRequest,
+    db: AsyncSession = Depends(get_async_db),
+    query_engine: QueryEngine = Depends(get_query_engine)
+):
+    """Answer several natural language queries in one request"""
+    try:
+        # Validate queries
+        if not batch_request.queries:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="At least one query is required"
+            )
+        
+        if len(batch_request.queries) > settings.MAX_BATCH_QUERIES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Too many queries. Maximum batch size is {settings.MAX_BATCH_QUERIES}"
+            )
+        
+        if any(not query.strip() for query in batch_request.queries):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Queries cannot be empty"
+            )
+        
+        # Process queries
+        response = await query_engine.process_batch_query(batch_request, db)
+        return response
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error processing batch query: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error processing batch query: {str(e)}"
+        )
+
 @router.get("/documents", response_model=DocumentListResponse)
 async def list_documents(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    exact: bool = False,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """List all uploaded documents"""
     try:
-        # Get documents with pagination
-        documents = db.query(Document).offset(skip).limit(limit).all()
-        total_count = db.query(Document).count()
-        
-        # Convert to response format
-        document_infos = []
-        for doc in documents:
-            doc_info = PydanticDocument(
-                id=doc.id,
-                filename=doc.filename,
-                file_type=doc.file_type,
-                file_size=doc.file_size,
-                file_path=doc.file_path,
-                upload_timestamp=doc.upload_timestamp
-            )
-            document_infos.append(doc_info)
+        if exact:
+            # Get a page of documents along with the exact total in one query
+            stmt = select(Document, func.count().over().label("total_count"))
+            total_count = None
+        else:
+            # Get documents with pagination and the maintained total
+            stmt = select(Document)
+            total_count = (await get_counts(db, Document))[Document.__tablename__]
+        stmt = stmt.offset(skip).limit(limit).execution_options(yield_per=200)
         
-        return DocumentListResponse(
-            documents=document_infos,
-            total_count=total_count
+        return StreamingResponse(
+            _stream_documents(stmt, total_count),
+            media_type="application/json"
         )
         
     except Exception as e:
@@ -160,14 +243,42 @@ async def list_documents(
             detail=f"Error listing documents: {str(e)}"
         )
 
+async def _stream_documents(stmt, total_count: Optional[int]) -> AsyncIterator[bytes]:
+    """Serialize a page of documents as they are read from a server-side cursor
+    
+    When total_count is None it is taken from the statement's window count.
+    """
+    # The request's session may be closed before the body is sent
+    async with AsyncSessionLocal() as db:
+        try:
+            result = await db.stream(stmt)
+            
+            yield b'{"documents":['
+            separator = b""
+            async for row in result:
+                if total_count is None:
+                    total_count = row.total_count
+                doc_info = PydanticDocument.model_validate(row[0])
+                yield separator + orjson.dumps(doc_info.model_dump())
+                separator = b","
+            
+            # Window count is unavailable when the page is past the end
+            if total_count is None:
+                total_count = (await get_counts(db, Document, exact=True))[Document.__tablename__]
+            yield b'],"total_count":' + str(total_count).encode() + b"}"
+        except Exception as e:
+            logger.error(f"Error streaming documents: {str(e)}")
+            raise
+
 @router.get("/documents/{document_id}")
 async def get_document(
-    document_id: str,
-    db: Session = Depends(get_db)
+    document_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    query_engine: QueryEngine = Depends(get_query_engine)
 ):
     """Get specific document information"""
     try:
-        document = db.query(Document).filter(Document.id == document_id).first()
+        document = await db.get(Document, document_id)
         if not document:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -202,13 +313,16 @@ async def get_document(
 
 @router.delete("/documents/{document_id}")
 async def delete_document(
-    document_id: str,
-    db: Session = Depends(get_db)
+    document_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    document_processor: DocumentProcessor = Depends(get_document_processor),
+    query_engine: QueryEngine = Depends(get_query_engine),
+    vector_store: VectorStore = Depends(get_vector_store)
 ):
     """Delete a document and its chunks"""
     try:
         # Check if document exists
-        document = db.query(Document).filter(Document.id == document_id).first()
+        document = await db.get(Document, document_id)
         if not document:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -220,6 +334,7 @@ async def delete_document(
         
         # Delete document and chunks
         success = await document_processor.delete_document(document_id, db)
+        query_engine.invalidate_document(document_id)
         
         if success:
             return {"message": "Document deleted successfully"}
@@ -239,45 +354,56 @@ async def delete_document(
         )
 
 @router.get("/health", response_model=HealthResponse)
-async def health_check(db: Session = Depends(get_db)):
+async def health_check(
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
+    vector_store: VectorStore = Depends(get_vector_store)
+):
     """Health check endpoint"""
+    # Probes hit this endpoint constantly - reuse recent results
+    health_status = _health_cache.get("status")
+    if health_status is None:
+        health_status = await _check_health(db, vector_store)
+        _health_cache["status"] = health_status
+    
+    response.headers["Cache-Control"] = f"max-age={settings.HEALTH_CACHE_TTL}"
+    return HealthResponse(
+        status=health_status,
+        timestamp=datetime.now(),
+        version="1.0.0"
+    )
+
+async def _check_health(db: AsyncSession, vector_store: VectorStore) -> str:
+    """Check database and vector store health"""
     try:
         # Check database connection
-        db.execute("SELECT 1")
-        db_status = "healthy"
+        await db.execute(text("SELECT 1"))
         
         # Check vector store
         vector_stats = vector_store.get_index_stats()
-        vector_status = "healthy" if vector_stats["total_vectors"] >= 0 else "unhealthy"
-        
-        return HealthResponse(
-            status="healthy",
-            timestamp=datetime.now(),
-            version="1.0.0"
-        )
+        return "healthy" if vector_stats["total_vectors"] >= 0 else "unhealthy"
         
     except Exception as e:
         logger.error(f"Health check failed: {str(e)}")
-        return HealthResponse(
-            status="unhealthy",
-            timestamp=datetime.now(),
-            version="1.0.0"
-        )
+        return "unhealthy"
 
-@router.get("/stats")
-async def get_system_stats(db: Session = Depends(get_db)):
+@router.get("/stats", response_class=ORJSONResponse)
+async def get_system_stats(
+    exact: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+    vector_store: VectorStore = Depends(get_vector_store)
+):
     """Get system statistics"""
     try:
-        # Document statistics
-        total_documents = db.query(Document).count()
-        
-        # Chunk statistics
-        total_chunks = db.query(DocumentChunk).count()
+        # Document and chunk statistics
+        counts = await get_counts(db, Document, DocumentChunk, exact=exact)
+        total_documents = counts[Document.__tablename__]
+        total_chunks = counts[DocumentChunk.__tablename__]
         
         # Vector store statistics
         vector_stats = vector_store.get_index_stats()
         
-        return {
+        return ORJSONResponse({
             "documents": {
                 "total": total_documents
             },
@@ -288,9 +414,9 @@ async def get_system_stats(db: Session = Depends(get_db)):
             "system": {
                 "version": "1.0.0",
                 "max_file_size": settings.MAX_FILE_SIZE,
-                "allowed_file_types": settings.ALLOWED_FILE_TYPES
+                "allowed_file_types": sorted(settings.ALLOWED_FILE_TYPES)
             }
-        }
+        })
         
     except Exception as e:
         logger.error(f"Error getting system stats: {str(e)}")
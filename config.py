@@ -1,6 +1,7 @@
 import os
-from pydantic_settings import BaseSettings
-from typing import List
+from functools import lru_cache
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from typing import FrozenSet, List
 
 class Settings(BaseSettings):
     # Application settings
@@ -15,32 +16,70 @@ class Settings(BaseSettings):
     
     # Database settings - use PostgreSQL for production
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///:memory:")
+    DB_POOL_SIZE: int = 20
     
     # Gemini API settings
     GEMINI_API_KEY: str = os.getenv("GEMINI_API_KEY", "")
     GEMINI_MODEL: str = "gemini-2.0-flash-exp"
     EMBEDDING_MODEL: str = "text-embedding-004"
+    EMBEDDING_BATCH_SIZE: int = 100  # Max texts per batch embedding request
+    EMBEDDING_CONCURRENCY: int = 16  # Max batch embedding requests in flight
+    EMBEDDING_MAX_RETRIES: int = 5  # Retries on rate limiting (HTTP 429)
+    EMBEDDING_FALLBACK_CONCURRENCY: int = 8  # Single-text requests in flight when batching fails
+    GEMINI_CONCURRENCY: int = 16  # Max text generation requests in flight
+    
+    # Query settings
+    MAX_BATCH_QUERIES: int = 48  # Max questions per batch query request
+    QUERY_CACHE_SIZE: int = 10_000  # Max cached query responses
+    QUERY_CACHE_TTL: int = 300  # Seconds to reuse a cached query response
+    QUERY_EMBEDDING_CACHE_SIZE: int = 4096  # Max cached query embeddings
     
     # Vector store settings
     VECTOR_DIMENSION: int = 768
     USE_PINECONE: bool = False
+    USE_PGVECTOR: bool = False  # Search with pgvector instead of FAISS (PostgreSQL only)
+    VECTOR_QUANTIZATION: str = "none"  # FAISS vector encoding: "none" (float32), "fp16" or "int8"
+    VECTOR_INDEX_TYPE: str = "hnsw"  # FAISS index structure: "hnsw" (approximate) or "flat" (exact)
+    HNSW_M: int = 32  # Graph neighbours per vector
+    HNSW_EF_CONSTRUCTION: int = 200  # Candidate list size while building the graph
+    HNSW_EF_SEARCH: int = 64  # Candidate list size per query
+    FILTERED_EXACT_SEARCH_MAX: int = 10_000  # Document-filtered HNSW searches score up to this many chunks exactly
+    SEARCH_BATCH_SIZE: int = 32  # Max concurrent queries coalesced into one FAISS search
+    SEARCH_BATCH_WAIT_MS: float = 5  # Wait for more queries to batch; 0 searches each query alone
+    FAISS_THREADS: int = 0  # OpenMP threads for FAISS searches; 0 uses every CPU
+    INDEX_FLUSH_INTERVAL: float = 30  # Seconds between saves of a changed FAISS index
+    INDEX_FLUSH_VECTORS: int = 1000  # Save sooner once this many vectors changed
     
     # Document processing settings
     MAX_FILE_SIZE: int = 10 * 1024 * 1024  # Reduced to 10MB for serverless
-    ALLOWED_FILE_TYPES: List[str] = [".pdf", ".docx", ".txt"]
+    UPLOAD_READ_SIZE: int = 1024 * 1024  # Read uploads in 1MB chunks
+    UPLOAD_SPOOL_SIZE: int = 2 * 1024 * 1024  # Spill uploads to disk above 2MB
+    ALLOWED_FILE_TYPES: FrozenSet[str] = frozenset({".pdf", ".docx", ".txt"})
     CHUNK_SIZE: int = 1000
     CHUNK_OVERLAP: int = 200
+    CHUNK_STRATEGY: str = "sentences"  # "sentences" (CHUNK_SIZE characters) or "tokens" (needs tiktoken)
+    CHUNK_TOKENS: int = 512  # Tokens per chunk with the "tokens" strategy
+    CHUNK_TOKEN_OVERLAP: int = 64  # Tokens shared by consecutive chunks
+    CHUNK_ENCODING: str = "cl100k_base"  # tiktoken encoding used to count tokens
     
     # Security settings
     SECRET_KEY: str = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     
+    # Monitoring settings
+    HEALTH_CACHE_TTL: int = 1  # Seconds to reuse a health check result
+    STATS_CACHE_TTL: int = 2  # Seconds to reuse vector store statistics
+    
     # CORS settings
     ALLOWED_ORIGINS: List[str] = ["*"]
     
-    class Config:
-        env_file = ".env"
-        case_sensitive = True
+    # Immutable once loaded, so the single cached instance is safe to share
+    model_config = SettingsConfigDict(env_file=".env", case_sensitive=True, frozen=True)
+
+@lru_cache
+def get_settings() -> Settings:
+    """Load the application settings once per process"""
+    return Settings()
 
-settings = Settings()
+settings = get_settings()
@@ -1,16 +1,45 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+import httpx
 import os
 
 # Import your modules
-from config import settings
+from database import engine, init_db
 from api.endpoints import router
+from services.document_processor import DocumentProcessor
+from services.gemini_service import GeminiService
+from services.query_engine import QueryEngine
+from services.vector_store import VectorStore
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_db()
+    
+    # Warm-initialize shared services once per process
+    app.state.http_client = httpx.AsyncClient(
+        http2=True,
+        timeout=30,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+    )
+    gemini_service = GeminiService(http_client=app.state.http_client)
+    app.state.vector_store = await VectorStore.create(gemini_service)
+    app.state.query_engine = QueryEngine(app.state.vector_store, gemini_service)
+    app.state.document_processor = DocumentProcessor()
+    yield
+    await app.state.vector_store.close()
+    app.state.document_processor.close()
+    await app.state.http_client.aclose()
+    await engine.dispose()
 
 # Create FastAPI app
 app = FastAPI(
     title="LLM-Powered Query-Retrieval System",
     description="Serverless document processing system",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # Add CORS middleware
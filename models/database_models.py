@@ -1,16 +1,16 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Float, ForeignKey, JSON
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, Float, ForeignKey, Index, JSON
 from sqlalchemy.sql import func
-from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
+from pgvector.sqlalchemy import Vector
 from datetime import datetime
-import uuid
 
-Base = declarative_base()
+from config import settings
+from database import Base
 
 class Document(Base):
     __tablename__ = "documents"
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     filename = Column(String(255), nullable=False)
     file_path = Column(String(500), nullable=False)
     file_type = Column(String(50), nullable=False)
@@ -26,19 +26,38 @@ class Document(Base):
 class DocumentChunk(Base):
     __tablename__ = "document_chunks"
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     document_id = Column(Integer, ForeignKey("documents.id"), nullable=False)
     chunk_index = Column(Integer, nullable=False)
     content = Column(Text, nullable=False)
-    embedding = Column(Text, nullable=True)  # Store as JSON string
+    content_hash = Column(String(64), nullable=True, index=True)
+    # pgvector column on PostgreSQL, JSON array elsewhere
+    embedding = Column(
+        Vector(settings.VECTOR_DIMENSION).with_variant(JSON(), "sqlite"),
+        nullable=True
+    )
     
     # Relationship
     document = relationship("Document", back_populates="chunks")
+    
+    __table_args__ = (
+        # Serves per-document lookups and ordered chunk retrieval
+        Index("ix_chunk_doc_idx", "document_id", "chunk_index"),
+        # Approximate nearest-neighbour index for cosine search (PostgreSQL only)
+        Index(
+            "ix_document_chunks_embedding_hnsw",
+            "embedding",
+            postgresql_using="hnsw",
+            postgresql_with={"m": 16, "ef_construction": 64},
+            postgresql_ops={"embedding": "vector_cosine_ops"}
+        ).ddl_if(dialect="postgresql"),
+    )
 
 class QueryLog(Base):
     __tablename__ = "query_logs"
     
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    # Sequential key keeps inserts appending to the right edge of the B-tree
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
     query_text = Column(Text, nullable=False)
     query_type = Column(String, nullable=False)
     document_ids = Column(JSON, nullable=True)
@@ -50,3 +69,13 @@ class QueryLog(Base):
     
     def __repr__(self):
         return f"<QueryLog(id={self.id}, query_text={self.query_text[:50]}...)>"
+
+class DocumentCounter(Base):
+    __tablename__ = "document_counters"
+    
+    # Row counts maintained alongside inserts/deletes, keyed by table name
+    name = Column(String(100), primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<DocumentCounter(name={self.name}, value={self.value})>"
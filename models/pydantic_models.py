@@ -25,12 +25,12 @@ class DocumentChunkBase(BaseModel):
 
 class DocumentChunkCreate(DocumentChunkBase):
     document_id: int
-    embedding: Optional[str] = None
+    embedding: Optional[List[float]] = None
 
 class PydanticDocumentChunk(DocumentChunkBase):
     id: int
     document_id: int
-    embedding: Optional[str] = None
+    embedding: Optional[List[float]] = None
     similarity_score: Optional[float] = None
 
     class Config:
@@ -49,6 +49,16 @@ class QueryResponse(BaseModel):
     explanation: Optional[str] = None
     suggested_queries: Optional[List[str]] = None
 
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+    max_results: int = 5
+    similarity_threshold: float = 0.7
+    document_ids: Optional[List[int]] = None
+
+class BatchQueryResponse(BaseModel):
+    results: List[QueryResponse]
+    total_queries: int
+
 # ADD THESE MISSING MODELS:
 
 class DocumentUploadResponse(BaseModel):
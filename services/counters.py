@@ -0,0 +1,49 @@
+import logging
+from typing import Dict
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.database_models import DocumentCounter
+
+logger = logging.getLogger(__name__)
+
+async def increment_counter(db: AsyncSession, model, delta: int):
+    """Adjust the maintained row count for a model within the current transaction"""
+    # Atomic in-database increment; counters that were never seeded are
+    # initialized from an exact count on first read instead
+    await db.execute(
+        update(DocumentCounter)
+        .where(DocumentCounter.name == model.__tablename__)
+        .values(value=DocumentCounter.value + delta)
+    )
+
+async def get_counts(db: AsyncSession, *models, exact: bool = False) -> Dict[str, int]:
+    """Get row counts for models keyed by table name, from counters unless exact"""
+    counts = {}
+    names = [model.__tablename__ for model in models]
+    
+    if not exact:
+        result = await db.execute(
+            select(DocumentCounter.name, DocumentCounter.value)
+            .where(DocumentCounter.name.in_(names))
+        )
+        counts = dict(result.all())
+    
+    missing = [model for model in models if model.__tablename__ not in counts]
+    if missing:
+        # Count all missing tables in a single round-trip
+        result = await db.execute(
+            select(*[select(func.count()).select_from(model).scalar_subquery() for model in missing])
+        )
+        exact_counts = result.one()
+        
+        for model, count in zip(missing, exact_counts):
+            counts[model.__tablename__] = count
+            if not exact:
+                # Seed the counter so later reads skip the full count
+                await db.merge(DocumentCounter(name=model.__tablename__, value=count))
+        
+        if not exact:
+            await db.commit()
+            logger.info(f"Seeded row counters for {[model.__tablename__ for model in missing]}")
+    
+    return counts
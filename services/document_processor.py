@@ -1,15 +1,23 @@
 import os
+import asyncio
 import hashlib
 import logging
-from typing import List, Dict, Any, Optional
+import tempfile
+from functools import lru_cache
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import List, Optional, BinaryIO, Tuple
 from pathlib import Path
-import aiofiles
+import fitz  # PyMuPDF
 import PyPDF2
 from docx import Document as DocxDocument
 import email
 from email.policy import default
-from sqlalchemy.orm import Session
+from html.parser import HTMLParser
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from models.database_models import Document, DocumentChunk
+from services.counters import increment_counter
+from utils.helpers import generate_hash
 from enum import Enum
 
 from config import settings
@@ -22,69 +30,313 @@ class DocumentType(str, Enum):
 
 logger = logging.getLogger(__name__)
 
-class DocumentProcessor:
+def parse_and_chunk(file_path: str, doc_type: str) -> List[str]:
+    """Extract text from a saved document and split it into chunks
+    
+    Runs in a worker process, so it takes and returns only picklable values.
+    """
+    with open(file_path, 'rb') as file_stream:
+        text_content = extract_text(file_stream, DocumentType(doc_type))
+    return create_chunks(text_content)
+
+def extract_text(file_stream: BinaryIO, doc_type: DocumentType) -> str:
+    """Extract text content from document stream based on type"""
+    try:
+        if doc_type == DocumentType.PDF:
+            return _extract_pdf_text(file_stream)
+        elif doc_type == DocumentType.DOCX:
+            return _extract_docx_text(file_stream)
+        elif doc_type == DocumentType.TXT:
+            return _extract_txt_text(file_stream)
+        elif doc_type == DocumentType.EMAIL:
+            return _extract_email_text(file_stream)
+        else:
+            raise ValueError(f"Unsupported document type: {doc_type}")
+    except Exception as e:
+        logger.error(f"Error extracting {doc_type.value} text: {str(e)}")
+        raise
+
+def _extract_pdf_text(file_stream: BinaryIO) -> str:
+    """Extract text from PDF stream"""
+    try:
+        with fitz.open(stream=file_stream.read(), filetype="pdf") as doc:
+            text = "\n".join(page.get_text("text") for page in doc)
+    except Exception as e:
+        # PyPDF2 is slower but copes with some PDFs MuPDF rejects
+        logger.warning(f"PyMuPDF failed to extract PDF text, falling back to PyPDF2: {str(e)}")
+        file_stream.seek(0)
+        text = _extract_pdf_text_pypdf2(file_stream)
+    return text.strip()
+
+def _extract_pdf_text_pypdf2(file_stream: BinaryIO) -> str:
+    """Extract text from PDF stream with PyPDF2"""
+    text = ""
+    try:
+        pdf_reader = PyPDF2.PdfReader(file_stream)
+        for page in pdf_reader.pages:
+            text += page.extract_text() + "\n"
+    except Exception as e:
+        logger.error(f"Error extracting PDF text: {str(e)}")
+        raise
+    return text
+
+def _extract_docx_text(file_stream: BinaryIO) -> str:
+    """Extract text from DOCX stream"""
+    try:
+        doc = DocxDocument(file_stream)
+        text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
+    except Exception as e:
+        logger.error(f"Error extracting DOCX text: {str(e)}")
+        raise
+    return text.strip()
+
+def _extract_txt_text(file_stream: BinaryIO) -> str:
+    """Extract text from TXT stream"""
+    try:
+        text = file_stream.read().decode('utf-8')
+    except Exception as e:
+        logger.error(f"Error extracting TXT text: {str(e)}")
+        raise
+    return text.strip()
+
+def _extract_email_text(file_stream: BinaryIO) -> str:
+    """Extract text from email stream"""
+    try:
+        msg = email.message_from_binary_file(file_stream, policy=default)
+        
+        text_parts = []
+        
+        # Extract headers
+        text_parts.append(f"Subject: {msg.get('Subject', 'N/A')}")
+        text_parts.append(f"From: {msg.get('From', 'N/A')}")
+        text_parts.append(f"To: {msg.get('To', 'N/A')}")
+        text_parts.append(f"Date: {msg.get('Date', 'N/A')}")
+        text_parts.append("---")
+        
+        # Extract body, decoding only the chosen part rather than every attachment
+        body = msg.get_body(preferencelist=('plain',))
+        if body is not None:
+            text_parts.append(body.get_content())
+        else:
+            html_body = msg.get_body(preferencelist=('html',))
+            if html_body is not None:
+                text_parts.append(_html_to_text(html_body.get_content()))
+        
+        text = "\n".join(text_parts)
+    except Exception as e:
+        logger.error(f"Error extracting email text: {str(e)}")
+        raise
+    return text.strip()
+
+class _HTMLTextExtractor(HTMLParser):
+    """Collects the text content of an HTML document"""
+    
     def __init__(self):
+        super().__init__()
+        self.parts = []
+    
+    def handle_data(self, data: str):
+        self.parts.append(data)
+
+def _html_to_text(html: str) -> str:
+    """Strip tags from an HTML body"""
+    extractor = _HTMLTextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return "".join(extractor.parts)
+
+def create_chunks(text: str) -> List[str]:
+    """Split text into chunks for processing"""
+    if not text:
+        return []
+    
+    if settings.CHUNK_STRATEGY == "sentences":
+        return _create_sentence_chunks(text)
+    elif settings.CHUNK_STRATEGY == "tokens":
+        return _create_token_chunks(text)
+    else:
+        raise ValueError(f"Unsupported chunk strategy: {settings.CHUNK_STRATEGY}")
+
+@lru_cache(maxsize=None)
+def _token_encoding():
+    """Load the tokenizer once per process"""
+    import tiktoken
+    return tiktoken.get_encoding(settings.CHUNK_ENCODING)
+
+def _create_token_chunks(text: str) -> List[str]:
+    """Split text into overlapping windows of CHUNK_TOKENS tokens"""
+    chunk_tokens = settings.CHUNK_TOKENS
+    step = chunk_tokens - settings.CHUNK_TOKEN_OVERLAP
+    if step <= 0:
+        raise ValueError("CHUNK_TOKEN_OVERLAP must be smaller than CHUNK_TOKENS")
+    
+    encoding = _token_encoding()
+    # Special-token markers in documents are treated as ordinary text
+    token_ids = encoding.encode(text, disallowed_special=())
+    
+    windows = []
+    for start in range(0, len(token_ids), step):
+        windows.append(token_ids[start:start + chunk_tokens])
+        if start + chunk_tokens >= len(token_ids):
+            break
+    
+    return [chunk for chunk in (window.strip() for window in encoding.decode_batch(windows)) if chunk]
+
+def _create_sentence_chunks(text: str) -> List[str]:
+    """Group whole sentences into chunks of up to CHUNK_SIZE characters"""
+    # Single pass over sentence end offsets, slicing each chunk out of the
+    # text once it is full
+    chunk_size = settings.CHUNK_SIZE
+    text_length = len(text)
+    chunks = []
+    start = 0  # Start of the current chunk
+    end = 0  # End of the last sentence in the current chunk
+    
+    while end < text_length:
+        sentence_end = text.find('.', end)
+        sentence_end = text_length if sentence_end == -1 else sentence_end + 1
+        
+        # Check if adding this sentence would exceed chunk size
+        if sentence_end - start > chunk_size and end > start:
+            chunk = text[start:end].strip()
+            if chunk:
+                chunks.append(chunk)
+            start = end
+        end = sentence_end
+    
+    # Add the last chunk
+    chunk = text[start:end].strip()
+    if chunk:
+        chunks.append(chunk)
+    
+    return chunks
+
+class DocumentProcessor:
+    def __init__(self, executor: Optional[Executor] = None):
         self.upload_dir = Path("uploads")
         self.upload_dir.mkdir(exist_ok=True)
         
-    async def process_document(self, file_content: bytes, filename: str, content_type: str, db: Session) -> Document:
-        """Process uploaded document and store in database"""
+        # Process pool for CPU-bound parsing, created here unless one is shared in
+        self._owns_executor = executor is None
+        self.executor = executor or ProcessPoolExecutor(max_workers=os.cpu_count())
+    
+    def close(self):
+        """Shut down the parser pool if this processor created it"""
+        if self._owns_executor:
+            self.executor.shutdown()
+        
+    async def process_document(
+        self,
+        file_stream: BinaryIO,
+        filename: str,
+        content_type: str,
+        db: AsyncSession
+    ) -> Tuple[Document, List[DocumentChunk]]:
+        """Process uploaded document stream and store in database
+        
+        Returns the document together with the chunk rows inserted for it.
+        """
         try:
             # Determine document type
             doc_type = self._get_document_type(filename, content_type)
             
-            # Generate unique filename
-            file_hash = hashlib.md5(file_content).hexdigest()
-            unique_filename = f"{file_hash}_{filename}"
-            file_path = self.upload_dir / unique_filename
+            # Save file in one worker thread hop
+            file_path, file_size, created_file = await asyncio.to_thread(self._save_stream, file_stream, filename)
+            unique_filename = file_path.name
             
-            # Save file
-            async with aiofiles.open(file_path, 'wb') as f:
-                await f.write(file_content)
+            # Start parsing as soon as the file is on disk so it overlaps the document
+            # insert. Neither transaction stays open while the file is parsed
+            loop = asyncio.get_running_loop()
+            parsing = loop.run_in_executor(
+                self.executor, parse_and_chunk, str(file_path), doc_type.value
+            )
             
             # Create document record
             document = Document(
                 filename=unique_filename,
                 file_path=str(file_path),
                 file_type=doc_type.value,
-                file_size=len(file_content)
+                file_size=file_size
             )
             
-            db.add(document)
-            db.commit()
-            db.refresh(document)
+            try:
+                db.add(document)
+                await increment_counter(db, Document, 1)
+                await db.commit()
+            except Exception as e:
+                parsing.cancel()
+                await db.rollback()
+                # Don't leave an orphaned upload behind; an identical earlier upload keeps its file
+                if created_file:
+                    file_path.unlink(missing_ok=True)
+                logger.error(f"Failed to store document {filename}: {str(e)}")
+                raise
+            
+            # Rolling back expires the document, so keep its id for cleanup
+            document_id = document.id
             
-            # Extract text and create chunks
             try:
-                text_content = await self._extract_text(file_path, doc_type)
-                chunks = self._create_chunks(text_content)
+                chunks = await parsing
                 
-                # Store chunks in database
-                for i, chunk_content in enumerate(chunks):
-                    chunk_hash = hashlib.md5(chunk_content.encode()).hexdigest()
-                    chunk = DocumentChunk(
-                        document_id=document.id,
-                        chunk_index=i,
-                        content=chunk_content
-                    )
-                    db.add(chunk)
+                # Store chunks in database with a single executemany INSERT,
+                # returning the new rows so callers need not query them back
+                rows = [
+                    {
+                        "document_id": document_id,
+                        "chunk_index": i,
+                        "content": chunk_content,
+                        "content_hash": generate_hash(chunk_content)
+                    }
+                    for i, chunk_content in enumerate(chunks)
+                ]
+                document_chunks = []
+                if rows:
+                    result = await db.scalars(insert(DocumentChunk).returning(DocumentChunk), rows)
+                    document_chunks = result.all()
+                await increment_counter(db, DocumentChunk, len(document_chunks))
                 
-                # Update document status
-                db.commit()
+                await db.commit()
                 
                 logger.info(f"Successfully processed document {filename} with {len(chunks)} chunks")
                 
             except Exception as e:
-                db.commit()
+                await db.rollback()
+                # Remove the committed document and, unless an identical upload uses it, its file
+                await self.delete_document(document_id, db)
                 logger.error(f"Failed to process document {filename}: {str(e)}")
                 raise
             
-            return document
+            return document, document_chunks
             
         except Exception as e:
             logger.error(f"Error processing document {filename}: {str(e)}")
             raise
     
+    def _save_stream(self, file_stream: BinaryIO, filename: str) -> Tuple[Path, int, bool]:
+        """Write a stream under a content-addressed name
+        
+        Hashes and writes in the same pass over the stream, then renames the
+        file into place once the hash is known. Returns the path, the size and
+        whether the file is new rather than replacing an identical upload.
+        """
+        read_size = settings.UPLOAD_READ_SIZE
+        file_hash = hashlib.md5()
+        
+        with tempfile.NamedTemporaryFile(dir=self.upload_dir, delete=False) as f:
+            try:
+                for block in iter(lambda: file_stream.read(read_size), b""):
+                    file_hash.update(block)
+                    f.write(block)
+            except BaseException:
+                os.unlink(f.name)
+                raise
+        
+        # Generate unique filename
+        file_path = self.upload_dir / f"{file_hash.hexdigest()}_{filename}"
+        created = not file_path.exists()
+        os.replace(f.name, file_path)
+        return file_path, file_stream.tell(), created
+    
     def _get_document_type(self, filename: str, content_type: str) -> DocumentType:
         """Determine document type from filename and content type"""
         extension = Path(filename).suffix.lower()
@@ -100,139 +352,39 @@ class DocumentProcessor:
         else:
             return DocumentType.TXT  # Default fallback
     
-    async def _extract_text(self, file_path: Path, doc_type: DocumentType) -> str:
-        """Extract text content from document based on type"""
-        try:
-            if doc_type == DocumentType.PDF:
-                return await self._extract_pdf_text(file_path)
-            elif doc_type == DocumentType.DOCX:
-                return await self._extract_docx_text(file_path)
-            elif doc_type == DocumentType.TXT:
-                return await self._extract_txt_text(file_path)
-            elif doc_type == DocumentType.EMAIL:
-                return await self._extract_email_text(file_path)
-            else:
-                raise ValueError(f"Unsupported document type: {doc_type}")
-        except Exception as e:
-            logger.error(f"Error extracting text from {file_path}: {str(e)}")
-            raise
-    
-    async def _extract_pdf_text(self, file_path: Path) -> str:
-        """Extract text from PDF file"""
-        text = ""
-        try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-        except Exception as e:
-            logger.error(f"Error extracting PDF text: {str(e)}")
-            raise
-        return text.strip()
-    
-    async def _extract_docx_text(self, file_path: Path) -> str:
-        """Extract text from DOCX file"""
-        try:
-            doc = DocxDocument(file_path)
-            text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
-        except Exception as e:
-            logger.error(f"Error extracting DOCX text: {str(e)}")
-            raise
-        return text.strip()
-    
-    async def _extract_txt_text(self, file_path: Path) -> str:
-        """Extract text from TXT file"""
-        try:
-            async with aiofiles.open(file_path, 'r', encoding='utf-8') as file:
-                text = await file.read()
-        except Exception as e:
-            logger.error(f"Error extracting TXT text: {str(e)}")
-            raise
-        return text.strip()
-    
-    async def _extract_email_text(self, file_path: Path) -> str:
-        """Extract text from email file"""
-        try:
-            with open(file_path, 'rb') as file:
-                msg = email.message_from_bytes(file.read(), policy=default)
-                
-                text_parts = []
-                
-                # Extract headers
-                text_parts.append(f"Subject: {msg.get('Subject', 'N/A')}")
-                text_parts.append(f"From: {msg.get('From', 'N/A')}")
-                text_parts.append(f"To: {msg.get('To', 'N/A')}")
-                text_parts.append(f"Date: {msg.get('Date', 'N/A')}")
-                text_parts.append("---")
-                
-                # Extract body
-                if msg.is_multipart():
-                    for part in msg.walk():
-                        if part.get_content_type() == "text/plain":
-                            text_parts.append(part.get_content())
-                else:
-                    if msg.get_content_type() == "text/plain":
-                        text_parts.append(msg.get_content())
-                
-                text = "\n".join(text_parts)
-        except Exception as e:
-            logger.error(f"Error extracting email text: {str(e)}")
-            raise
-        return text.strip()
-    
-    def _create_chunks(self, text: str) -> List[str]:
-        """Split text into chunks for processing"""
-        if not text:
-            return []
-        
-        # Simple chunking strategy - split by sentences and group
-        sentences = text.split('.')
-        chunks = []
-        current_chunk = ""
-        
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if not sentence:
-                continue
-                
-            # Check if adding this sentence would exceed chunk size
-            if len(current_chunk) + len(sentence) + 1 > settings.CHUNK_SIZE:
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                current_chunk = sentence + "."
-            else:
-                current_chunk += sentence + "."
-        
-        # Add the last chunk
-        if current_chunk:
-            chunks.append(current_chunk.strip())
-        
-        return chunks
-    
-    async def delete_document(self, document_id: str, db: Session) -> bool:
+    async def delete_document(self, document_id: int, db: AsyncSession) -> bool:
         """Delete document and associated chunks"""
         try:
             # Get document
-            document = db.query(Document).filter(Document.id == document_id).first()
+            document = await db.get(Document, document_id)
             if not document:
                 return False
             
-            # Delete file
+            # Delete file, unless an identical upload still uses it
             file_path = Path(document.file_path)
-            if file_path.exists():
+            shared = await db.scalar(
+                select(func.count())
+                .select_from(Document)
+                .where(Document.file_path == document.file_path, Document.id != document_id)
+            )
+            if not shared and file_path.exists():
                 file_path.unlink()
             
             # Delete chunks
-            db.query(DocumentChunk).filter(DocumentChunk.document_id == document_id).delete()
+            result = await db.execute(
+                delete(DocumentChunk).where(DocumentChunk.document_id == document_id)
+            )
+            await increment_counter(db, DocumentChunk, -result.rowcount)
             
             # Delete document
-            db.delete(document)
-            db.commit()
+            await db.delete(document)
+            await increment_counter(db, Document, -1)
+            await db.commit()
             
             logger.info(f"Successfully deleted document {document_id}")
             return True
             
         except Exception as e:
             logger.error(f"Error deleting document {document_id}: {str(e)}")
-            db.rollback()
+            await db.rollback()
             return False 
\ No newline at end of file
@@ -1,39 +1,118 @@
+import asyncio
 import google.generativeai as genai
+import httpx
 import logging
-from typing import List
+from typing import Any, Dict, List, Optional, Union
 from config import settings
 
 logger = logging.getLogger(__name__)
 
+GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta"
+
 class GeminiService:
-    def __init__(self):
+    def __init__(self, http_client: Optional[httpx.AsyncClient] = None):
         genai.configure(api_key=settings.GEMINI_API_KEY)
         self.model = genai.GenerativeModel(settings.GEMINI_MODEL)
-        
-    async def get_embedding(self, text: str) -> List[float]:
-        """Get embedding using Gemini"""
+
+        # Embeddings go through the REST API on a shared keep-alive client
+        self.http_client = http_client or httpx.AsyncClient(http2=True, timeout=30)
+        self.embedding_model = f"models/{settings.EMBEDDING_MODEL}"
+
+        # Bounds the single-text requests issued when batch embedding fails
+        self._fallback_semaphore = asyncio.Semaphore(settings.EMBEDDING_FALLBACK_CONCURRENCY)
+        # Caps concurrent text generation without serializing it
+        self._generate_semaphore = asyncio.Semaphore(settings.GEMINI_CONCURRENCY)
+
+    async def get_embedding(self, text: Union[str, List[str]]) -> Union[List[float], List[List[float]]]:
+        """Get embedding using Gemini
+
+        A list of texts is embedded in one batch request and returns one vector per text.
+        """
+        if isinstance(text, list):
+            return await self.embed_batch(text)
+
         try:
-            result = genai.embed_content(
-                model=settings.EMBEDDING_MODEL,
-                content=text,
-                task_type="retrieval_document"
-            )
-            return result['embedding']
+            return await self._embed_one(text)
         except Exception as e:
             logger.error(f"Error getting Gemini embedding: {str(e)}")
             return [0.0] * 768  # Gemini embedding dimension
-            
+
+    async def embed_each(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts with concurrent single-text requests
+
+        Fallback for when the batch endpoint is unavailable.
+        """
+        async def embed(text: str) -> List[float]:
+            async with self._fallback_semaphore:
+                return await self._embed_one(text)
+
+        return await asyncio.gather(*[embed(text) for text in texts])
+
+    async def _embed_one(self, text: str) -> List[float]:
+        """Embed a single text, raising on failure"""
+        result = await self._post(f"{self.embedding_model}:embedContent", {
+            "model": self.embedding_model,
+            "content": {"parts": [{"text": text}]},
+            "taskType": "RETRIEVAL_DOCUMENT"
+        })
+        return result['embedding']['values']
+
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Get embeddings for a batch of texts in a single Gemini request"""
+        payload = {
+            "requests": [
+                {
+                    "model": self.embedding_model,
+                    "content": {"parts": [{"text": text}]},
+                    "taskType": "RETRIEVAL_DOCUMENT"
+                }
+                for text in texts
+            ]
+        }
+
+        delay = 1.0
+        for attempt in range(settings.EMBEDDING_MAX_RETRIES + 1):
+            try:
+                result = await self._post(f"{self.embedding_model}:batchEmbedContents", payload)
+                return [embedding['values'] for embedding in result['embeddings']]
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code != 429:
+                    logger.error(f"Error getting Gemini batch embedding: {str(e)}")
+                    raise
+                # Rate limited - back off exponentially before retrying
+                if attempt == settings.EMBEDDING_MAX_RETRIES:
+                    logger.error(f"Gemini batch embedding rate limited after {attempt + 1} attempts")
+                    raise
+                logger.warning(f"Gemini batch embedding rate limited, retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                delay *= 2
+            except Exception as e:
+                logger.error(f"Error getting Gemini batch embedding: {str(e)}")
+                raise
+
+    async def _post(self, method: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Call a Gemini REST method and return the decoded JSON response"""
+        response = await self.http_client.post(
+            f"{GEMINI_API_URL}/{method}",
+            json=payload,
+            headers={"x-goog-api-key": settings.GEMINI_API_KEY}
+        )
+        response.raise_for_status()
+        return response.json()
+
     async def generate_text(self, prompt: str, max_tokens: int = 150) -> str:
         """Generate text using Gemini"""
         try:
-            response = self.model.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    max_output_tokens=max_tokens,
-                    temperature=0.3
+            # Async SDK call, so concurrent generations overlap instead of blocking the loop
+            async with self._generate_semaphore:
+                response = await self.model.generate_content_async(
+                    prompt,
+                    generation_config=genai.types.GenerationConfig(
+                        max_output_tokens=max_tokens,
+                        temperature=0.3
+                    )
                 )
-            )
             return response.text
         except Exception as e:
             logger.error(f"Error generating text with Gemini: {str(e)}")
-            return "Unable to generate response." 
\ No newline at end of file
+            return "Unable to generate response."
@@ -1,83 +1,171 @@
 import logging
-from typing import List, Dict, Any, Optional
-from sqlalchemy.orm import Session
+from typing import List, Dict, Optional, Tuple
+from cachetools import TTLCache
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from services.gemini_service import GeminiService
-from models.database_models import Document, DocumentChunk, QueryLog
-from models.pydantic_models import QueryRequest, QueryResponse, DocumentChunk as PydanticDocumentChunk
+from models.database_models import DocumentChunk, QueryLog
+from models.pydantic_models import (
+    QueryRequest,
+    QueryResponse,
+    BatchQueryRequest,
+    BatchQueryResponse,
+    PydanticDocumentChunk
+)
 from services.vector_store import VectorStore
 from config import settings
+from utils.helpers import query_hash
 import time
 
 logger = logging.getLogger(__name__)
 
 class QueryEngine:
-    def __init__(self):
-        self.vector_store = VectorStore()
-        self.gemini_service = GeminiService()
+    def __init__(self, vector_store: VectorStore, gemini_service: GeminiService):
+        self.vector_store = vector_store
+        self.gemini_service = gemini_service
+        
+        # Recent responses keyed by normalized query and document scope
+        self._response_cache = TTLCache(maxsize=settings.QUERY_CACHE_SIZE, ttl=settings.QUERY_CACHE_TTL)
+        
+        # Epochs folded into cache keys; bumping one invalidates dependent entries
+        self._corpus_epoch = 0
+        self._document_epochs: Dict[int, int] = {}
     
-    async def process_query(self, query_request: QueryRequest, db: Session) -> QueryResponse:
+    async def process_query(self, query_request: QueryRequest, db: AsyncSession) -> QueryResponse:
         """Process user query and return relevant results"""
         start_time = time.time()
         
         try:
-            # Search for similar chunks
-            similar_chunks = await self.vector_store.search_similar_chunks(
-                query=query_request.query,
-                k=query_request.max_results,
-                similarity_threshold=query_request.similarity_threshold,
-                document_ids=query_request.document_ids,
-                db=db
-            )
+            cache_key = self._cache_key(query_request)
+            response = self._response_cache.get(cache_key)
             
-            # Convert to response format
-            result_chunks = []
-            for chunk, similarity_score in similar_chunks:
-                result_chunk = PydanticDocumentChunk(
-                    id=chunk.id,
-                    document_id=chunk.document_id,
-                    chunk_index=chunk.chunk_index,
-                    content=chunk.content,
-                    embedding=chunk.embedding,
-                    similarity_score=similarity_score
+            if response is None:
+                # Search for similar chunks
+                similar_chunks = await self.vector_store.search_similar_chunks(
+                    query=query_request.query,
+                    k=query_request.max_results,
+                    similarity_threshold=query_request.similarity_threshold,
+                    document_ids=query_request.document_ids,
+                    db=db
+                )
+                
+                # Convert to response format
+                result_chunks = self._to_result_chunks(similar_chunks)
+                
+                # Generate explanation if requested
+                explanation = None
+                if result_chunks:
+                    explanation = await self._generate_explanation(
+                        query_request.query, 
+                        result_chunks[:3]  # Use top 3 results for explanation
+                    )
+                
+                response = QueryResponse(
+                    query=query_request.query,
+                    results=result_chunks,
+                    total_results=len(result_chunks),
+                    explanation=explanation
                 )
-                result_chunks.append(result_chunk)
+                self._response_cache[cache_key] = response
             
             processing_time = time.time() - start_time
             
-            # Generate explanation if requested
-            explanation = None
-            if result_chunks:
-                explanation = await self._generate_explanation(
-                    query_request.query, 
-                    result_chunks[:3]  # Use top 3 results for explanation
-                )
-            
             # Log query
             query_log = QueryLog(
                 query_text=query_request.query,
                 query_type="semantic",  # Default query type
                 document_ids=query_request.document_ids,
-                results_count=len(result_chunks),
+                results_count=response.total_results,
                 processing_time=processing_time,
                 similarity_threshold=query_request.similarity_threshold
             )
             db.add(query_log)
-            db.commit()
+            await db.commit()
             
-            response = QueryResponse(
-                query=query_request.query,
-                results=result_chunks,
-                total_results=len(result_chunks),
-                explanation=explanation
-            )
-            
-            logger.info(f"Processed query '{query_request.query}' with {len(result_chunks)} results in {processing_time:.2f}s")
+            logger.info(f"Processed query '{query_request.query}' with {response.total_results} results in {processing_time:.2f}s")
             return response
             
         except Exception as e:
             logger.error(f"Error processing query: {str(e)}")
             raise
     
+    def invalidate_document(self, document_id: int):
+        """Drop cached responses that could include the given document"""
+        self._document_epochs[document_id] = self._document_epochs.get(document_id, 0) + 1
+        self._corpus_epoch += 1
+    
+    def _cache_key(self, query_request: QueryRequest) -> tuple:
+        """Build the response cache key for a query request"""
+        if query_request.document_ids is None:
+            scope = self._corpus_epoch
+        else:
+            scope = tuple(
+                (document_id, self._document_epochs.get(document_id, 0))
+                for document_id in sorted(set(query_request.document_ids))
+            )
+        
+        return (query_hash(query_request.query), query_request.max_results, query_request.similarity_threshold, scope)
+    
+    async def process_batch_query(self, batch_request: BatchQueryRequest, db: AsyncSession) -> BatchQueryResponse:
+        """Process several queries with one embedding request and one batched search"""
+        start_time = time.time()
+        
+        try:
+            # Embed all uncached queries in a single Gemini request
+            query_embeddings = await self.vector_store.get_query_embeddings(batch_request.queries)
+            
+            # Search all queries at once; the session can't serve concurrent statements
+            similar_chunks = await self.vector_store.search_by_embeddings(
+                query_embeddings,
+                k=batch_request.max_results,
+                similarity_threshold=batch_request.similarity_threshold,
+                document_ids=batch_request.document_ids,
+                db=db
+            )
+            search_results = [self._to_result_chunks(chunks) for chunks in similar_chunks]
+            
+            processing_time = time.time() - start_time
+            
+            responses = []
+            for query, result_chunks in zip(batch_request.queries, search_results):
+                responses.append(QueryResponse(
+                    query=query,
+                    results=result_chunks,
+                    total_results=len(result_chunks)
+                ))
+                
+                # Log query
+                db.add(QueryLog(
+                    query_text=query,
+                    query_type="semantic_batch",
+                    document_ids=batch_request.document_ids,
+                    results_count=len(result_chunks),
+                    processing_time=processing_time,
+                    similarity_threshold=batch_request.similarity_threshold
+                ))
+            await db.commit()
+            
+            logger.info(f"Processed batch of {len(responses)} queries in {processing_time:.2f}s")
+            return BatchQueryResponse(results=responses, total_queries=len(responses))
+            
+        except Exception as e:
+            logger.error(f"Error processing batch query: {str(e)}")
+            raise
+    
+    def _to_result_chunks(self, similar_chunks: List[Tuple[DocumentChunk, float]]) -> List[PydanticDocumentChunk]:
+        """Convert (chunk, score) search results to response models"""
+        result_chunks = []
+        for chunk, similarity_score in similar_chunks:
+            result_chunk = PydanticDocumentChunk(
+                id=chunk.id,
+                document_id=chunk.document_id,
+                chunk_index=chunk.chunk_index,
+                content=chunk.content,
+                similarity_score=similarity_score
+            )
+            result_chunks.append(result_chunk)
+        return result_chunks
+    
     async def _generate_explanation(self, query: str, top_chunks: List[PydanticDocumentChunk]) -> str:
         """Generate explanation using Gemini"""
         try:
@@ -104,13 +192,17 @@ Please provide a concise explanation (2-3 sentences) of how these results relate
             logger.error(f"Error generating explanation: {str(e)}")
             return "Unable to generate explanation for the search results."
     
-    async def get_document_summary(self, document_id: str, db: Session) -> Optional[str]:
+    async def get_document_summary(self, document_id: int, db: AsyncSession) -> Optional[str]:
         """Generate summary for a specific document"""
         try:
             # Get document chunks
-            chunks = db.query(DocumentChunk).filter(
-                DocumentChunk.document_id == document_id
-            ).order_by(DocumentChunk.chunk_index).limit(5).all()  # First 5 chunks
+            result = await db.execute(
+                select(DocumentChunk)
+                .where(DocumentChunk.document_id == document_id)
+                .order_by(DocumentChunk.chunk_index)
+                .limit(5)  # First 5 chunks
+            )
+            chunks = result.scalars().all()
             
             if not chunks:
                 return None
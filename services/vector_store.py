@@ -1,62 +1,416 @@
+import asyncio
 import numpy as np
 import faiss
 import pickle
 import logging
-from typing import List, Dict, Any, Optional, Tuple
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from pathlib import Path
+from cachetools import LRUCache, TTLCache, cachedmethod
 from services.gemini_service import GeminiService
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update
+from sqlalchemy.orm import load_only
+from sqlalchemy.ext.asyncio import AsyncSession
 from models.database_models import DocumentChunk
 from config import settings
+from utils.helpers import query_hash
 
 logger = logging.getLogger(__name__)
 
+# FAISS factory codes for the supported vector encodings
+_INDEX_ENCODINGS = {
+    "none": "Flat",  # Raw float32 vectors
+    "fp16": "SQfp16",  # Half-precision floats, no training needed
+    "int8": "SQ8",  # Scalar-quantized to 8 bits per dimension
+}
+
+# Chunk columns needed to build search results; leaves the embedding unloaded
+_RESULT_COLUMNS = load_only(
+    DocumentChunk.id,
+    DocumentChunk.document_id,
+    DocumentChunk.chunk_index,
+    DocumentChunk.content
+)
+
+class _SearchBatcher:
+    """Coalesces concurrent single-vector searches into one batched FAISS search
+    
+    A flat scan over a batch of queries is a single matrix product instead of
+    one per query, so concurrent searches share the cost of reading the index.
+    """
+    
+    def __init__(
+        self,
+        search: Callable[[np.ndarray, int], Tuple[np.ndarray, np.ndarray]],
+        max_batch: int,
+        max_wait: float
+    ):
+        self._search = search
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+    
+    async def search(self, query_vector: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Search for one (1, d) query vector, returning (1, k) scores and labels"""
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((query_vector, k, future))
+        return await future
+    
+    async def close(self):
+        """Stop the batching worker"""
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            
+            # Gather whatever else arrives within the wait window
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            try:
+                queries = np.vstack([query_vector for query_vector, _, _ in batch])
+                scores, labels = self._search(queries, max(k for _, k, _ in batch))
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            for i, (_, k, future) in enumerate(batch):
+                if not future.done():
+                    future.set_result((scores[i:i + 1, :k], labels[i:i + 1, :k]))
+
 class VectorStore:
-    def __init__(self):
+    def __init__(self, gemini_service: Optional[GeminiService] = None):
         self.dimension = 768  # Gemini embedding dimension
         self.index_path = Path("vector_index")
         self.index_path.mkdir(exist_ok=True)
         
         # Initialize Gemini service
-        self.gemini_service = GeminiService()
+        self.gemini_service = gemini_service or GeminiService()
+        
+        # Short-lived cache for index statistics polled by health/stats
+        self._stats_cache = TTLCache(maxsize=1, ttl=settings.STATS_CACHE_TTL)
+        
+        # Embeddings of recent queries, keyed by a hash of the normalized text
+        self._query_embedding_cache = LRUCache(maxsize=settings.QUERY_EMBEDDING_CACHE_SIZE)
         
-        # Initialize FAISS index
+        # Vectors changed since the index was last saved; saves are debounced
+        self._unsaved_changes = 0
+        self._flush_task: Optional[asyncio.Task] = None
+        
+        # HNSW graphs can't drop nodes. Removed chunk ids are hidden from searches
+        # until a background rebuild compacts them out of the graph
+        self._removed_ids = np.empty(0, dtype=np.int64)
+        self._compaction_task: Optional[asyncio.Task] = None
+        # Vectors added while a rebuild runs, replayed onto the rebuilt index
+        self._pending_adds: Optional[List[Tuple[np.ndarray, np.ndarray]]] = None
+        
+        # Initialize FAISS index last; migrating an old index uses the state above
         self.index = None
-        self.chunk_ids = []
         self._load_or_create_index()
+        
+        # Unfiltered searches are batched across concurrent queries
+        self._search_batcher = None
+        if settings.SEARCH_BATCH_WAIT_MS > 0:
+            self._search_batcher = _SearchBatcher(
+                lambda queries, k: self.index.search(queries, k),
+                max_batch=settings.SEARCH_BATCH_SIZE,
+                max_wait=settings.SEARCH_BATCH_WAIT_MS / 1000
+            )
+    
+    @classmethod
+    async def create(cls, gemini_service: Optional[GeminiService] = None) -> "VectorStore":
+        """Create a vector store, loading and warming the index off the event loop"""
+        # Batched searches are matrix products that FAISS spreads over OpenMP threads
+        faiss.omp_set_num_threads(settings.FAISS_THREADS or os.cpu_count())
+        
+        store = await asyncio.to_thread(cls, gemini_service)
+        await asyncio.to_thread(store._warm_up)
+        store._flush_task = asyncio.create_task(store._periodic_flush())
+        return store
+    
+    def _warm_up(self):
+        """Run a throwaway search so the first query doesn't pay one-time setup costs"""
+        # Faults the index pages into memory and spins up the BLAS/OpenMP threads
+        if self.index.ntotal > 0:
+            self.index.search(np.zeros((1, self.dimension), dtype=np.float32), 1)
+    
+    async def close(self):
+        """Stop batching searches and persist the index on shutdown"""
+        if self._search_batcher is not None:
+            await self._search_batcher.close()
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        # Let a running rebuild finish so removed vectors aren't saved
+        if self._compaction_task is not None:
+            await asyncio.shield(self._compaction_task)
+        await self._flush()
     
     def _load_or_create_index(self):
         """Load existing FAISS index or create new one"""
         index_file = self.index_path / "faiss_index.bin"
         metadata_file = self.index_path / "chunk_metadata.pkl"
         
+        if not index_file.exists():
+            # Create new index
+            self.index = self._create_index()
+            logger.info("Created new FAISS index")
+            return
+        
         try:
-            if index_file.exists() and metadata_file.exists():
-                # Load existing index
-                self.index = faiss.read_index(str(index_file))
-                with open(metadata_file, 'rb') as f:
-                    self.chunk_ids = pickle.load(f)
-                logger.info(f"Loaded existing FAISS index with {len(self.chunk_ids)} vectors")
-            else:
-                # Create new index
-                self.index = faiss.IndexFlatIP(self.dimension)  # Inner product for cosine similarity
-                self.chunk_ids = []
-                logger.info("Created new FAISS index")
-        except Exception as e:
+            # Load existing index
+            index = faiss.read_index(str(index_file))
+        except RuntimeError as e:
             logger.error(f"Error loading FAISS index: {str(e)}")
             # Create new index as fallback
-            self.index = faiss.IndexFlatIP(self.dimension)
-            self.chunk_ids = []
+            self.index = self._create_index()
+            return
+        
+        if not isinstance(index, faiss.IndexIDMap2):
+            # Older indexes are positional, with chunk ids kept alongside. A failed
+            # migration stops startup rather than replacing the vectors on disk
+            with open(metadata_file, 'rb') as f:
+                chunk_ids = pickle.load(f)
+            index = self._migrate_positional_index(index, chunk_ids)
+            
+            # Ids now live in the index itself, so the sidecar can go
+            faiss.write_index(index, str(index_file))
+            metadata_file.unlink()
+        
+        labels = faiss.vector_to_array(index.id_map)
+        unlabelled = labels == -1
+        if unlabelled.any():
+            # Vectors removed before the last save never got compacted out; drop them now
+            vectors = index.index.reconstruct_n(0, index.ntotal)[~unlabelled]
+            index = self._build_index(vectors, labels[~unlabelled])
+            self._unsaved_changes += int(unlabelled.sum())
+            logger.info(f"Compacted {int(unlabelled.sum())} removed vectors out of the loaded FAISS index")
+        self.index = index
+        self._configure_index(self.index)
+        logger.info(f"Loaded existing FAISS index with {self.index.ntotal} vectors")
+    
+    def _migrate_positional_index(self, index: faiss.Index, chunk_ids: List[int]) -> faiss.IndexIDMap2:
+        """Rebuild a positional index as one labelled with chunk ids"""
+        vectors = index.reconstruct_n(0, index.ntotal) if index.ntotal else None
+        
+        self.index = self._create_index()
+        if vectors is not None:
+            self._add_vectors(vectors, np.asarray(chunk_ids, dtype=np.int64))
+        
+        logger.info(f"Migrated positional FAISS index with {index.ntotal} vectors")
+        return self.index
+    
+    def _create_index(self) -> faiss.IndexIDMap2:
+        """Create an empty FAISS index using the configured structure and vector encoding"""
+        encoding = _INDEX_ENCODINGS.get(settings.VECTOR_QUANTIZATION)
+        if encoding is None:
+            raise ValueError(f"Unsupported vector quantization: {settings.VECTOR_QUANTIZATION}")
+        
+        if settings.VECTOR_INDEX_TYPE == "hnsw":
+            # Graph index: sublinear search at a small recall cost
+            description = f"HNSW{settings.HNSW_M}"
+            if encoding != "Flat":
+                description += f"_{encoding}"
+        elif settings.VECTOR_INDEX_TYPE == "flat":
+            description = encoding
+        else:
+            raise ValueError(f"Unsupported vector index type: {settings.VECTOR_INDEX_TYPE}")
+        
+        # Vectors are labelled with their chunk ids, so results need no lookup table
+        # and removals don't shift positions. Inner product on normalized vectors
+        # gives cosine similarity.
+        index = faiss.index_factory(self.dimension, f"IDMap2,{description}", faiss.METRIC_INNER_PRODUCT)
+        
+        hnsw = self._hnsw(index)
+        if hnsw is not None:
+            hnsw.efConstruction = settings.HNSW_EF_CONSTRUCTION
+        
+        if not index.is_trained:
+            # Scalar quantizers learn per-dimension value ranges. Normalized
+            # embeddings always lie within [-1, 1], so train on those bounds rather
+            # than on whatever the first batch happens to be
+            bounds = np.stack([
+                np.full(self.dimension, -1.0, dtype=np.float32),
+                np.full(self.dimension, 1.0, dtype=np.float32)
+            ])
+            index.train(bounds)
+        
+        self._configure_index(index)
+        return index
+    
+    def _configure_index(self, index: faiss.IndexIDMap2):
+        """Apply query-time parameters, which are not taken from the saved index"""
+        hnsw = self._hnsw(index)
+        if hnsw is not None:
+            hnsw.efSearch = settings.HNSW_EF_SEARCH
     
-    def _save_index(self):
-        """Save FAISS index and metadata"""
+    @staticmethod
+    def _hnsw(index: faiss.IndexIDMap2):
+        """Return the HNSW graph under an ID-mapped index, if it has one"""
+        return getattr(faiss.downcast_index(index.index), "hnsw", None)
+    
+    def _search_params(self, selector: faiss.IDSelector, k: int, selected: int) -> faiss.SearchParameters:
+        """Search parameters restricting results to the selected chunk ids"""
+        if self._hnsw(self.index) is not None:
+            # The graph walk only visits efSearch candidates, most of them filtered out
+            # when few vectors are selected, so widen it in proportion. Explicit
+            # parameters replace the index's own efSearch
+            ef_search = max(settings.HNSW_EF_SEARCH, k)
+            ef_search = max(ef_search * self.index.ntotal // max(selected, 1), ef_search)
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=int(min(ef_search, self.index.ntotal)))
+        return faiss.SearchParameters(sel=selector)
+    
+    def _exact_search(self, query_vectors: np.ndarray, chunk_ids: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Score queries against the given chunks' vectors exactly, in FAISS result layout"""
+        scores = np.full((len(query_vectors), k), -np.finfo(np.float32).max, dtype=np.float32)
+        indices = np.full((len(query_vectors), k), -1, dtype=np.int64)
+        
+        labels = faiss.vector_to_array(self.index.id_map)
+        positions = np.flatnonzero(np.isin(labels, chunk_ids))
+        if not len(positions):
+            return scores, indices
+        
+        similarities = query_vectors @ self.index.index.reconstruct_batch(positions).T
+        top = min(k, len(positions))
+        best = np.argpartition(-similarities, top - 1, axis=1)[:, :top]
+        best_scores = np.take_along_axis(similarities, best, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        
+        scores[:, :top] = np.take_along_axis(best_scores, order, axis=1)
+        indices[:, :top] = labels[positions[np.take_along_axis(best, order, axis=1)]]
+        return scores, indices
+    
+    def _add_vectors(self, vectors: np.ndarray, chunk_ids: np.ndarray):
+        """Add vectors labelled with chunk ids"""
+        self.index.add_with_ids(vectors, chunk_ids)
+        if self._pending_adds is not None:
+            self._pending_adds.append((vectors, chunk_ids))
+    
+    def _remove_vectors(self, chunk_ids: np.ndarray) -> int:
+        """Remove the vectors labelled with the given chunk ids"""
+        if self._hnsw(self.index) is None:
+            return self.index.remove_ids(faiss.IDSelectorBatch(chunk_ids))
+        
+        # Hide the vectors right away and compact the graph in the background
+        labels = faiss.vector_to_array(self.index.id_map)
+        present = np.setdiff1d(chunk_ids[np.isin(chunk_ids, labels)], self._removed_ids)
+        if len(present):
+            self._removed_ids = np.union1d(self._removed_ids, present)
+            self._start_compaction()
+        return int(len(present))
+    
+    def _start_compaction(self) -> asyncio.Task:
+        """Start rebuilding the graph without removed vectors, unless a rebuild is running"""
+        if self._compaction_task is None:
+            self._compaction_task = asyncio.create_task(self._compact())
+        return self._compaction_task
+    
+    async def _compact(self):
+        """Rebuild the HNSW graph off the event loop until no removed vectors remain"""
         try:
-            index_file = self.index_path / "faiss_index.bin"
-            metadata_file = self.index_path / "chunk_metadata.pkl"
+            while len(self._removed_ids):
+                removed = self._removed_ids
+                
+                # Copy the surviving vectors here; the graph is built from the copy in a
+                # worker thread while searches and adds keep using the live index
+                labels = faiss.vector_to_array(self.index.id_map)
+                keep = ~np.isin(labels, removed)
+                vectors = self.index.index.reconstruct_n(0, self.index.ntotal)[keep]
+                labels = labels[keep]
+                
+                self._pending_adds = []
+                try:
+                    try:
+                        index = await asyncio.to_thread(self._build_index, vectors, labels)
+                    except Exception as e:
+                        logger.warning(f"Background FAISS rebuild failed, rebuilding on the event loop: {str(e)}")
+                        index = self._build_index(vectors, labels)
+                    for pending_vectors, pending_ids in self._pending_adds:
+                        index.add_with_ids(pending_vectors, pending_ids)
+                finally:
+                    self._pending_adds = None
+                
+                self.index = index
+                # Ids removed during the rebuild are still hidden; the loop compacts them next
+                self._removed_ids = np.setdiff1d(self._removed_ids, removed)
+                self._stats_cache.clear()
+                await self._mark_changed(len(removed))
+                logger.info(f"Compacted {len(removed)} removed vectors out of the FAISS index")
+        except Exception as e:
+            # Removed vectors stay hidden and are saved unlabelled; the periodic
+            # flush starts another rebuild
+            logger.error(f"Error compacting FAISS index: {str(e)}")
+        finally:
+            self._compaction_task = None
+    
+    def _build_index(self, vectors: np.ndarray, chunk_ids: np.ndarray) -> faiss.IndexIDMap2:
+        """Build a new index holding the given vectors"""
+        index = self._create_index()
+        if len(chunk_ids):
+            index.add_with_ids(vectors, chunk_ids)
+        return index
+    
+    async def _mark_changed(self, count: int):
+        """Record index changes, saving right away once enough have built up"""
+        self._unsaved_changes += count
+        if self._unsaved_changes >= settings.INDEX_FLUSH_VECTORS:
+            await self._flush()
+    
+    async def _periodic_flush(self):
+        """Save the index at a fixed interval while it has unsaved changes"""
+        while True:
+            await asyncio.sleep(settings.INDEX_FLUSH_INTERVAL)
+            await self._flush()
+            if len(self._removed_ids):
+                # Retry a rebuild that failed
+                self._start_compaction()
+    
+    async def _flush(self):
+        """Save the index if it has changed since the last save"""
+        if not self._unsaved_changes:
+            return
+        
+        # Serialize on the event loop, where the index is mutated, then write off it
+        data = faiss.serialize_index(self.index)
+        self._unsaved_changes = 0
+        await asyncio.to_thread(self._save_index, data, self._removed_ids)
+    
+    def _save_index(self, data: np.ndarray, removed_ids: np.ndarray):
+        """Save a serialized FAISS index, replacing the previous file atomically
+        
+        Vectors still awaiting compaction are saved unlabelled, so they stay
+        hidden if the process restarts before the rebuild finishes.
+        """
+        try:
+            if len(removed_ids):
+                index = faiss.deserialize_index(data)
+                labels = faiss.vector_to_array(index.id_map)
+                labels[np.isin(labels, removed_ids)] = -1
+                faiss.copy_array_to_vector(labels, index.id_map)
+                data = faiss.serialize_index(index)
             
-            faiss.write_index(self.index, str(index_file))
-            with open(metadata_file, 'wb') as f:
-                pickle.dump(self.chunk_ids, f)
+            index_file = self.index_path / "faiss_index.bin"
+            temp_file = index_file.with_suffix(".tmp")
+            data.tofile(temp_file)
+            os.replace(temp_file, index_file)
             
             logger.info("FAISS index saved successfully")
         except Exception as e:
@@ -66,143 +420,328 @@ class VectorStore:
         """Get embedding for text using Gemini API"""
         return await self.gemini_service.get_embedding(text)
     
-    async def add_document_chunks(self, chunks: List[DocumentChunk], db: Session):
+    async def get_query_embedding(self, query: str) -> List[float]:
+        """Get embedding for a search query, reusing recent results"""
+        key = query_hash(query)
+        embedding = self._query_embedding_cache.get(key)
+        if embedding is None:
+            embedding = await self.get_embedding(query)
+            # A zero vector means the request failed; don't keep it
+            if any(embedding):
+                self._query_embedding_cache[key] = embedding
+        return embedding
+    
+    async def get_query_embeddings(self, queries: List[str]) -> List[List[float]]:
+        """Get embeddings for several search queries, batching the uncached ones"""
+        keys = [query_hash(query) for query in queries]
+        
+        # Hold on to the hits locally; the cache may evict them while the misses are embedded
+        embeddings_by_key = {}
+        missing = {}
+        for key, query in zip(keys, queries):
+            embedding = self._query_embedding_cache.get(key)
+            if embedding is not None:
+                embeddings_by_key[key] = embedding
+            else:
+                missing.setdefault(key, query)
+        
+        if missing:
+            embeddings = await self.gemini_service.embed_batch(list(missing.values()))
+            new_embeddings = dict(zip(missing.keys(), embeddings))
+            self._query_embedding_cache.update(new_embeddings)
+            embeddings_by_key.update(new_embeddings)
+        
+        return [embeddings_by_key[key] for key in keys]
+    
+    async def add_document_chunks(self, chunks: List[DocumentChunk], db: AsyncSession):
         """Add document chunks to vector store"""
         try:
-            vectors = []
-            chunk_ids = []
+            # Reuse stored embeddings for content that was embedded before
+            embeddings_by_key = await self._stored_embeddings(chunks, db)
             
+            # Each distinct new content is embedded once, longest first so the
+            # slowest batches start first
+            pending = {}
             for chunk in chunks:
-                # Get embedding for chunk content
-                embedding = await self.get_embedding(chunk.content)
-                
-                # Normalize embedding for cosine similarity
-                embedding_array = np.array(embedding, dtype=np.float32)
-                embedding_array = embedding_array / np.linalg.norm(embedding_array)
-                
-                vectors.append(embedding_array)
-                chunk_ids.append(chunk.id)
-                
-                # Store embedding in database
-                chunk.embedding = embedding
-                db.add(chunk)
-            
-            if vectors:
-                # Add to FAISS index
-                vectors_array = np.array(vectors)
-                self.index.add(vectors_array)
-                self.chunk_ids.extend(chunk_ids)
-                
-                # Save index
-                self._save_index()
+                key = self._content_key(chunk)
+                if key not in embeddings_by_key:
+                    pending.setdefault(key, chunk.content)
+            pending = sorted(pending.items(), key=lambda item: len(item[1]), reverse=True)
+            
+            if len(pending) < len(chunks):
+                logger.info(f"Reusing embeddings for {len(chunks) - len(pending)} duplicate chunks")
+            
+            # Embed chunk contents in concurrent batched requests
+            texts = [content for _, content in pending]
+            batch_size = settings.EMBEDDING_BATCH_SIZE
+            batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+            semaphore = asyncio.Semaphore(settings.EMBEDDING_CONCURRENCY)
+            
+            async def embed(batch: List[str]) -> List[List[float]]:
+                async with semaphore:
+                    try:
+                        return await self.gemini_service.embed_batch(batch)
+                    except Exception as e:
+                        logger.warning(f"Batch embedding failed, embedding texts individually: {str(e)}")
+                return await self.gemini_service.embed_each(batch)
+            
+            batch_embeddings = await asyncio.gather(*[embed(batch) for batch in batches])
+            new_embeddings = (embedding for batch in batch_embeddings for embedding in batch)
+            embeddings_by_key.update(zip((key for key, _ in pending), new_embeddings))
+            embeddings = [embeddings_by_key[self._content_key(chunk)] for chunk in chunks]
+            
+            mappings = [
+                {"id": chunk.id, "embedding": embedding}
+                for chunk, embedding in zip(chunks, embeddings)
+            ]
+            
+            if mappings:
+                # pgvector searches the stored embeddings directly
+                if not settings.USE_PGVECTOR:
+                    # Normalize embeddings for cosine similarity
+                    vectors = np.asarray(embeddings, dtype=np.float32)
+                    faiss.normalize_L2(vectors)
+                    
+                    # Add to FAISS index in one call
+                    chunk_ids = np.fromiter((chunk.id for chunk in chunks), dtype=np.int64, count=len(chunks))
+                    if np.isin(chunk_ids, self._removed_ids).any():
+                        # Reused ids must not be hidden or compacted away with the old vectors
+                        await asyncio.shield(self._start_compaction())
+                        if np.isin(chunk_ids, self._removed_ids).any():
+                            raise RuntimeError("Removed vectors could not be compacted out of the FAISS index")
+                    self._add_vectors(vectors, chunk_ids)
+                    await self._mark_changed(len(chunk_ids))
                 
-                # Commit database changes
-                db.commit()
+                # Store embeddings in database in one bulk update
+                await db.execute(update(DocumentChunk), mappings)
+                await db.commit()
                 
-                logger.info(f"Added {len(vectors)} chunks to vector store")
+                logger.info(f"Added {len(mappings)} chunks to vector store")
         
         except Exception as e:
             logger.error(f"Error adding chunks to vector store: {str(e)}")
-            db.rollback()
+            await db.rollback()
             raise
     
+    async def _stored_embeddings(self, chunks: List[DocumentChunk], db: AsyncSession) -> Dict[str, Any]:
+        """Look up existing embeddings for chunks by content hash"""
+        content_hashes = {chunk.content_hash for chunk in chunks if chunk.content_hash}
+        if not content_hashes:
+            return {}
+        
+        result = await db.execute(
+            select(DocumentChunk.content_hash, DocumentChunk.embedding)
+            .where(DocumentChunk.content_hash.in_(content_hashes))
+            .where(DocumentChunk.embedding.is_not(None))
+        )
+        embeddings = {}
+        for content_hash, embedding in result:
+            embeddings.setdefault(content_hash, embedding)
+        return embeddings
+    
+    @staticmethod
+    def _content_key(chunk: DocumentChunk) -> str:
+        """Key identifying a chunk's content for embedding reuse"""
+        return chunk.content_hash or chunk.content
+    
     async def search_similar_chunks(
         self, 
         query: str, 
         k: int = 5, 
         similarity_threshold: float = 0.7,
-        document_ids: Optional[List[str]] = None,
-        db: Session = None
+        document_ids: Optional[List[int]] = None,
+        db: AsyncSession = None
     ) -> List[Tuple[DocumentChunk, float]]:
         """Search for similar chunks using vector similarity"""
         try:
             # Get query embedding
-            query_embedding = await self.get_embedding(query)
-            query_vector = np.array(query_embedding, dtype=np.float32)
-            query_vector = query_vector / np.linalg.norm(query_vector)
+            query_embedding = await self.get_query_embedding(query)
+        except Exception as e:
+            logger.error(f"Error embedding query: {str(e)}")
+            return []
+        
+        return await self.search_by_embedding(
+            query_embedding,
+            k=k,
+            similarity_threshold=similarity_threshold,
+            document_ids=document_ids,
+            db=db
+        )
+    
+    async def search_by_embedding(
+        self,
+        query_embedding: List[float],
+        k: int = 5,
+        similarity_threshold: float = 0.7,
+        document_ids: Optional[List[int]] = None,
+        db: AsyncSession = None
+    ) -> List[Tuple[DocumentChunk, float]]:
+        """Search for similar chunks using a precomputed query embedding"""
+        results = await self.search_by_embeddings(
+            [query_embedding],
+            k=k,
+            similarity_threshold=similarity_threshold,
+            document_ids=document_ids,
+            db=db
+        )
+        return results[0]
+    
+    async def search_by_embeddings(
+        self,
+        query_embeddings: List[List[float]],
+        k: int = 5,
+        similarity_threshold: float = 0.7,
+        document_ids: Optional[List[int]] = None,
+        db: AsyncSession = None
+    ) -> List[List[Tuple[DocumentChunk, float]]]:
+        """Search for similar chunks for several precomputed query embeddings
+        
+        The session is only used sequentially: the FAISS searches need no database,
+        and the chunks matched by every query are loaded in a single query.
+        """
+        if settings.USE_PGVECTOR:
+            # One statement per query, run one at a time on the shared session
+            return [
+                await self._search_pgvector(query_embedding, k, similarity_threshold, document_ids, db)
+                for query_embedding in query_embeddings
+            ]
+        
+        try:
+            query_vectors = np.array(query_embeddings, dtype=np.float32)
+            faiss.normalize_L2(query_vectors)
             
-            # Search in FAISS index
-            scores, indices = self.index.search(query_vector.reshape(1, -1), k * 2)  # Get more results to filter
+            # Restrict the search to the requested documents' chunks inside the index
+            params = None
+            exact_results = None
+            if document_ids:
+                result = await db.execute(
+                    select(DocumentChunk.id).where(DocumentChunk.document_id.in_(document_ids))
+                )
+                allowed_ids = np.fromiter(result.scalars(), dtype=np.int64)
+                if len(self._removed_ids):
+                    allowed_ids = np.setdiff1d(allowed_ids, self._removed_ids)
+                if not len(allowed_ids):
+                    return [[] for _ in query_embeddings]
+                
+                if self._hnsw(self.index) is not None and len(allowed_ids) <= settings.FILTERED_EXACT_SEARCH_MAX:
+                    # A graph walk filtered down to a few chunks can miss the true
+                    # neighbours; scoring that few directly is exact and cheap
+                    exact_results = self._exact_search(query_vectors, allowed_ids, k)
+                else:
+                    params = self._search_params(faiss.IDSelectorBatch(allowed_ids), k, len(allowed_ids))
+            elif len(self._removed_ids):
+                # Skip vectors that are removed but not yet compacted out of the graph
+                removed_selector = faiss.IDSelectorBatch(self._removed_ids)
+                params = self._search_params(
+                    faiss.IDSelectorNot(removed_selector), k, self.index.ntotal - len(self._removed_ids)
+                )
+            
+            # Search in FAISS index; several queries already make one batched search
+            if exact_results is not None:
+                scores, indices = exact_results
+            elif params is None and self._search_batcher is not None and len(query_vectors) == 1:
+                scores, indices = await self._search_batcher.search(query_vectors, k)
+            else:
+                scores, indices = self.index.search(query_vectors, k, params=params)
+            
+            candidates = [
+                [
+                    (int(chunk_id), float(score))
+                    for score, chunk_id in zip(query_scores, query_indices)
+                    if chunk_id != -1 and score >= similarity_threshold  # Skip invalid and below threshold
+                ]
+                for query_scores, query_indices in zip(scores, indices)
+            ]
+            candidate_ids = {chunk_id for query_candidates in candidates for chunk_id, _ in query_candidates}
+            if not candidate_ids:
+                return [[] for _ in query_embeddings]
+            
+            # Get all candidate chunks from database in one query
+            result = await db.execute(
+                select(DocumentChunk)
+                .options(_RESULT_COLUMNS)
+                .where(DocumentChunk.id.in_(candidate_ids))
+            )
+            chunks_by_id = {chunk.id: chunk for chunk in result.scalars()}
+            
+            results = [
+                [
+                    (chunks_by_id[chunk_id], score)
+                    for chunk_id, score in query_candidates
+                    if chunk_id in chunks_by_id
+                ]
+                for query_candidates in candidates
+            ]
+            
+            logger.info(f"Found {sum(map(len, results))} similar chunks for {len(results)} queries")
+            return results
+        
+        except Exception as e:
+            logger.error(f"Error searching similar chunks: {str(e)}")
+            return [[] for _ in query_embeddings]
+    
+    async def _search_pgvector(
+        self,
+        query_embedding: List[float],
+        k: int,
+        similarity_threshold: float,
+        document_ids: Optional[List[int]],
+        db: AsyncSession
+    ) -> List[Tuple[DocumentChunk, float]]:
+        """Search for similar chunks with the pgvector HNSW index"""
+        try:
+            distance = DocumentChunk.embedding.cosine_distance(query_embedding).label("distance")
+            stmt = select(DocumentChunk, distance).options(_RESULT_COLUMNS).order_by(distance).limit(k)
+            if document_ids:
+                stmt = stmt.where(DocumentChunk.document_id.in_(document_ids))
+            
+            result = await db.execute(stmt)
             
             results = []
-            for score, idx in zip(scores[0], indices[0]):
-                if idx == -1:  # Invalid index
-                    continue
-                
+            for chunk, chunk_distance in result.all():
+                score = 1.0 - chunk_distance
                 if score < similarity_threshold:  # Below threshold
-                    continue
-                
-                chunk_id = self.chunk_ids[idx]
-                
-                # Get chunk from database
-                chunk = db.query(DocumentChunk).filter(DocumentChunk.id == chunk_id).first()
-                if not chunk:
-                    continue
-                
-                # Filter by document IDs if specified
-                if document_ids and chunk.document_id not in document_ids:
-                    continue
-                
-                results.append((chunk, float(score)))
-                
-                if len(results) >= k:
                     break
+                results.append((chunk, float(score)))
             
             logger.info(f"Found {len(results)} similar chunks for query")
             return results
         
         except Exception as e:
-            logger.error(f"Error searching similar chunks: {str(e)}")
+            logger.error(f"Error searching similar chunks with pgvector: {str(e)}")
             return []
     
-    async def remove_document_chunks(self, document_id: str, db: Session):
+    async def remove_document_chunks(self, document_id: int, db: AsyncSession):
         """Remove document chunks from vector store"""
+        if settings.USE_PGVECTOR:
+            return  # Embeddings are deleted along with their chunk rows
+        
         try:
             # Get chunk IDs for the document
-            chunks = db.query(DocumentChunk).filter(DocumentChunk.document_id == document_id).all()
-            chunk_ids_to_remove = [chunk.id for chunk in chunks]
+            result = await db.execute(
+                select(DocumentChunk.id).where(DocumentChunk.document_id == document_id)
+            )
+            chunk_ids_to_remove = result.scalars().all()
             
             if not chunk_ids_to_remove:
                 return
             
-            # Find indices in FAISS index
-            indices_to_remove = []
-            for i, chunk_id in enumerate(self.chunk_ids):
-                if chunk_id in chunk_ids_to_remove:
-                    indices_to_remove.append(i)
-            
-            # Remove from FAISS index (rebuild index without removed vectors)
-            if indices_to_remove:
-                # Get all vectors except the ones to remove
-                all_vectors = []
-                remaining_chunk_ids = []
-                
-                for i in range(len(self.chunk_ids)):
-                    if i not in indices_to_remove:
-                        vector = self.index.reconstruct(i)
-                        all_vectors.append(vector)
-                        remaining_chunk_ids.append(self.chunk_ids[i])
-                
-                # Rebuild index
-                self.index = faiss.IndexFlatIP(self.dimension)
-                if all_vectors:
-                    vectors_array = np.array(all_vectors)
-                    self.index.add(vectors_array)
-                
-                self.chunk_ids = remaining_chunk_ids
-                self._save_index()
-                
-                logger.info(f"Removed {len(indices_to_remove)} chunks from vector store")
+            # Remove from FAISS index by chunk id
+            removed = self._remove_vectors(np.asarray(chunk_ids_to_remove, dtype=np.int64))
+            await self._mark_changed(removed)
+            
+            logger.info(f"Removed {removed} chunks from vector store")
         
         except Exception as e:
             logger.error(f"Error removing chunks from vector store: {str(e)}")
             raise
     
+    @cachedmethod(lambda self: self._stats_cache)
     def get_index_stats(self) -> Dict[str, Any]:
         """Get vector store statistics"""
         return {
-            "total_vectors": self.index.ntotal if self.index else 0,
+            "total_vectors": self.index.ntotal - len(self._removed_ids) if self.index else 0,
             "dimension": self.dimension,
-            "index_type": "FAISS IndexFlatIP",
-            "chunk_count": len(self.chunk_ids)
+            "index_type": f"FAISS {type(faiss.downcast_index(self.index.index)).__name__}",
+            "chunk_count": self.index.ntotal - len(self._removed_ids) if self.index else 0
         } 
\ No newline at end of file
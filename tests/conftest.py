@@ -0,0 +1,70 @@
+import hashlib
+import os
+import sys
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import pytest
+
+# Settings are read at import time; tests never reach the real Gemini API
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine  # noqa: E402
+
+from config import settings  # noqa: E402
+from database import Base  # noqa: E402
+import models.database_models  # noqa: E402,F401
+
+def fake_embedding(text: str) -> List[float]:
+    """Deterministic pseudo-random embedding for a text"""
+    seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+    return np.random.default_rng(seed).standard_normal(settings.VECTOR_DIMENSION).tolist()
+
+class FakeGeminiService:
+    """Stands in for GeminiService with deterministic embeddings"""
+    
+    async def get_embedding(self, text):
+        if isinstance(text, list):
+            return await self.embed_batch(text)
+        return fake_embedding(text)
+    
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        return [fake_embedding(text) for text in texts]
+    
+    async def embed_each(self, texts: List[str]) -> List[List[float]]:
+        return await self.embed_batch(texts)
+    
+    async def generate_text(self, prompt: str, max_tokens: int = 1000) -> str:
+        return "generated"
+
+@pytest.fixture
+def gemini_service():
+    return FakeGeminiService()
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run in a temporary directory, where the vector index and uploads are written"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture
+def file_db(workdir):
+    """Open a file-backed SQLite database with a real connection pool
+    
+    Used as ``async with file_db() as session_factory`` inside the test's event
+    loop, since pooled aiosqlite connections are bound to the loop that made them.
+    """
+    @asynccontextmanager
+    async def open_db():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{workdir / 'app.db'}")
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            yield async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+        finally:
+            await engine.dispose()
+    
+    return open_db
@@ -0,0 +1,83 @@
+import asyncio
+import io
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import func, select
+
+import services.document_processor as document_processor_module
+from models.database_models import Document
+from services.document_processor import DocumentProcessor
+
+@pytest.fixture
+def document_processor(workdir):
+    # Threads instead of processes so tests can swap in their own parser
+    executor = ThreadPoolExecutor(max_workers=2)
+    yield DocumentProcessor(executor=executor)
+    executor.shutdown()
+
+def test_parsing_runs_outside_the_write_transaction(file_db, document_processor, workdir, monkeypatch):
+    def parse_and_chunk(file_path, doc_type):
+        # Give the upload time to write first if it (wrongly) writes before parsing
+        time.sleep(0.2)
+        # Another writer must be able to take the database write lock mid-parse
+        with sqlite3.connect(workdir / "app.db", timeout=0) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.rollback()
+        return ["first chunk", "second chunk"]
+    
+    monkeypatch.setattr(document_processor_module, "parse_and_chunk", parse_and_chunk)
+    
+    async def scenario():
+        async with file_db() as session_factory:
+            async with session_factory() as db:
+                return await document_processor.process_document(
+                    io.BytesIO(b"First chunk. Second chunk."), "doc.txt", "text/plain", db
+                )
+    
+    document, chunks = asyncio.run(scenario())
+    
+    assert document.id is not None
+    assert [chunk.content for chunk in chunks] == ["first chunk", "second chunk"]
+
+def test_document_is_stored_while_parsing(file_db, document_processor, workdir, monkeypatch):
+    def parse_and_chunk(file_path, doc_type):
+        # Only finishes once the document row has been committed alongside the parse
+        deadline = time.monotonic() + 5
+        with sqlite3.connect(workdir / "app.db", timeout=1) as conn:
+            while time.monotonic() < deadline:
+                if conn.execute("SELECT count(*) FROM documents").fetchone()[0]:
+                    return ["only chunk"]
+                time.sleep(0.01)
+        raise AssertionError("document was not stored while parsing")
+    
+    monkeypatch.setattr(document_processor_module, "parse_and_chunk", parse_and_chunk)
+    
+    async def scenario():
+        async with file_db() as session_factory:
+            async with session_factory() as db:
+                return await document_processor.process_document(
+                    io.BytesIO(b"Only chunk."), "doc.txt", "text/plain", db
+                )
+    
+    document, chunks = asyncio.run(scenario())
+    
+    assert [chunk.content for chunk in chunks] == ["only chunk"]
+    assert chunks[0].document_id == document.id
+
+def test_failed_upload_leaves_no_file_or_row(file_db, document_processor, workdir):
+    async def scenario():
+        async with file_db() as session_factory:
+            async with session_factory() as db:
+                with pytest.raises(Exception):
+                    await document_processor.process_document(
+                        io.BytesIO(b"not a docx"), "broken.docx", "application/octet-stream", db
+                    )
+                return await db.scalar(select(func.count()).select_from(Document))
+    
+    document_count = asyncio.run(scenario())
+    
+    assert document_count == 0
+    assert list((workdir / "uploads").iterdir()) == []
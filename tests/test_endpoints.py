@@ -0,0 +1,61 @@
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import func, select
+from starlette.datastructures import Headers
+
+from api.endpoints import upload_document
+from models.database_models import Document, DocumentChunk
+from services.document_processor import DocumentProcessor
+from services.query_engine import QueryEngine
+from services.vector_store import VectorStore
+from tests.conftest import FakeGeminiService
+
+class FailingGeminiService(FakeGeminiService):
+    """Gemini stand-in whose embedding requests always fail"""
+    
+    async def embed_batch(self, texts):
+        raise RuntimeError("embedding unavailable")
+    
+    async def embed_each(self, texts):
+        raise RuntimeError("embedding unavailable")
+
+def test_upload_is_undone_when_embedding_fails(file_db, workdir):
+    gemini_service = FailingGeminiService()
+    executor = ThreadPoolExecutor(max_workers=1)
+    
+    async def scenario():
+        async with file_db() as session_factory:
+            vector_store = await VectorStore.create(gemini_service)
+            try:
+                async with session_factory() as db:
+                    with pytest.raises(HTTPException) as raised:
+                        await upload_document(
+                            file=UploadFile(
+                                io.BytesIO(b"First sentence. Second sentence."),
+                                filename="doc.txt",
+                                headers=Headers({"content-type": "text/plain"})
+                            ),
+                            db=db,
+                            document_processor=DocumentProcessor(executor=executor),
+                            query_engine=QueryEngine(vector_store, gemini_service),
+                            vector_store=vector_store
+                        )
+                    document_count = await db.scalar(select(func.count()).select_from(Document))
+                    chunk_count = await db.scalar(select(func.count()).select_from(DocumentChunk))
+                    return raised.value.status_code, document_count, chunk_count
+            finally:
+                await vector_store.close()
+    
+    try:
+        status_code, document_count, chunk_count = asyncio.run(scenario())
+    finally:
+        executor.shutdown()
+    
+    assert status_code == 500
+    assert document_count == 0
+    assert chunk_count == 0
+    assert list((workdir / "uploads").iterdir()) == []
@@ -0,0 +1,25 @@
+import pytest
+
+from utils import helpers
+
+def test_hyperscan_prefilter_finds_entity_types():
+    pytest.importorskip("hyperscan")
+    assert helpers._hyperscan_database() is not None
+    
+    assert helpers._entity_fields("nothing to see here") == ()
+    assert helpers._entity_fields("due 2023-01-02") == ("dates_found",)
+    # Every pattern matching stops the scan early
+    assert helpers._entity_fields("Call 555-123-4567 or a@b.com by 12/05/2023") == (
+        "dates_found", "emails_found", "phones_found"
+    )
+
+def test_extract_metadata_finds_all_entity_types():
+    metadata = helpers.extract_metadata_from_text("Call 555-123-4567 or mail a@b.com by 12/05/2023.")
+    
+    assert metadata["dates_found"] == ["12/05/2023"]
+    assert metadata["emails_found"] == ["a@b.com"]
+    assert metadata["phones_found"] == ["555-123-4567"]
+
+def test_query_hash_ignores_case_and_whitespace():
+    assert helpers.query_hash("  What is  the\tPolicy? ") == helpers.query_hash("what is the policy?")
+    assert helpers.query_hash("what is the policy?") != helpers.query_hash("what is the premium?")
@@ -0,0 +1,47 @@
+import asyncio
+
+from models.database_models import Document, DocumentChunk
+from models.pydantic_models import BatchQueryRequest
+from services.query_engine import QueryEngine
+from services.vector_store import VectorStore
+
+async def _index_document(session_factory, vector_store, contents):
+    """Store a document with one chunk per content and index its embeddings"""
+    async with session_factory() as db:
+        document = Document(filename="doc.txt", file_path="doc.txt", file_type="txt", file_size=1)
+        db.add(document)
+        await db.flush()
+        chunks = [
+            DocumentChunk(document_id=document.id, chunk_index=i, content=content)
+            for i, content in enumerate(contents)
+        ]
+        db.add_all(chunks)
+        await db.commit()
+        await vector_store.add_document_chunks(chunks, db)
+        return document.id
+
+def test_batch_query_on_pooled_database(file_db, gemini_service):
+    contents = [f"chunk about topic {i}" for i in range(20)]
+    
+    async def scenario():
+        async with file_db() as session_factory:
+            vector_store = await VectorStore.create(gemini_service)
+            try:
+                await _index_document(session_factory, vector_store, contents)
+                query_engine = QueryEngine(vector_store, gemini_service)
+                
+                async with session_factory() as db:
+                    return await query_engine.process_batch_query(
+                        BatchQueryRequest(queries=contents[:5], max_results=3, similarity_threshold=0.5),
+                        db
+                    )
+            finally:
+                await vector_store.close()
+    
+    response = asyncio.run(scenario())
+    
+    assert response.total_queries == 5
+    for query, query_response in zip(contents, response.results):
+        # Each query is the exact text of a chunk, which must come back first
+        assert query_response.results
+        assert query_response.results[0].content == query
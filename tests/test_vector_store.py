@@ -0,0 +1,275 @@
+import asyncio
+import pickle
+import threading
+
+import numpy as np
+import faiss
+import pytest
+
+import services.vector_store as vector_store_module
+from models.database_models import Document, DocumentChunk
+from services.vector_store import VectorStore
+from tests.conftest import fake_embedding
+
+def _use_settings(monkeypatch, **overrides):
+    """Replace the vector store's settings for one test"""
+    monkeypatch.setattr(vector_store_module, "settings", vector_store_module.settings.model_copy(update=overrides))
+
+def _unit_vectors(count: int, dimension: int, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).standard_normal((count, dimension)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+@pytest.mark.parametrize("quantization", ["none", "fp16", "int8"])
+def test_recall_after_single_vector_first_batch(workdir, gemini_service, monkeypatch, index_type, quantization):
+    _use_settings(monkeypatch, VECTOR_INDEX_TYPE=index_type, VECTOR_QUANTIZATION=quantization)
+    store = VectorStore(gemini_service)
+    vectors = _unit_vectors(300, store.dimension)
+    ids = np.arange(1, len(vectors) + 1, dtype=np.int64)
+    
+    # A one-chunk document indexed first must not skew quantization for later ones
+    store._add_vectors(vectors[:1], ids[:1])
+    store._add_vectors(vectors[1:], ids[1:])
+    
+    _, labels = store.index.search(vectors, 1)
+    recall = float(np.mean(labels[:, 0] == ids))
+    assert recall >= 0.95
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+def test_legacy_positional_index_is_migrated(workdir, gemini_service, monkeypatch, index_type):
+    _use_settings(monkeypatch, VECTOR_INDEX_TYPE=index_type, VECTOR_QUANTIZATION="none")
+    vectors = _unit_vectors(5, 768)
+    chunk_ids = [11, 12, 13, 14, 15]
+    
+    # The old layout: a positional IndexFlatIP with chunk ids pickled alongside
+    legacy_index = faiss.IndexFlatIP(768)
+    legacy_index.add(vectors)
+    (workdir / "vector_index").mkdir()
+    faiss.write_index(legacy_index, str(workdir / "vector_index" / "faiss_index.bin"))
+    with open(workdir / "vector_index" / "chunk_metadata.pkl", "wb") as f:
+        pickle.dump(chunk_ids, f)
+    
+    store = VectorStore(gemini_service)
+    
+    assert store.index.ntotal == len(chunk_ids)
+    _, labels = store.index.search(vectors, 1)
+    assert labels[:, 0].tolist() == chunk_ids
+    assert not (workdir / "vector_index" / "chunk_metadata.pkl").exists()
+    saved = faiss.read_index(str(workdir / "vector_index" / "faiss_index.bin"))
+    assert isinstance(saved, faiss.IndexIDMap2) and saved.ntotal == len(chunk_ids)
+
+def test_failed_migration_keeps_the_legacy_index(workdir, gemini_service):
+    legacy_index = faiss.IndexFlatIP(768)
+    legacy_index.add(_unit_vectors(5, 768))
+    index_file = workdir / "vector_index" / "faiss_index.bin"
+    index_file.parent.mkdir()
+    faiss.write_index(legacy_index, str(index_file))
+    
+    # Without its chunk ids the index can't be migrated, and must not be replaced
+    with pytest.raises(FileNotFoundError):
+        VectorStore(gemini_service)
+    assert faiss.read_index(str(index_file)).ntotal == 5
+
+async def _store_document(db, contents):
+    """Insert a document with one chunk per content and return its chunks"""
+    document = Document(filename="doc.txt", file_path="doc.txt", file_type="txt", file_size=1)
+    db.add(document)
+    await db.flush()
+    chunks = [
+        DocumentChunk(document_id=document.id, chunk_index=i, content=content)
+        for i, content in enumerate(contents)
+    ]
+    db.add_all(chunks)
+    await db.commit()
+    return chunks
+
+def test_removed_hnsw_vectors_are_hidden_then_compacted(file_db, gemini_service, monkeypatch):
+    _use_settings(monkeypatch, VECTOR_INDEX_TYPE="hnsw", VECTOR_QUANTIZATION="none")
+    removed_contents = [f"removed chunk {i}" for i in range(30)]
+    kept_contents = [f"kept chunk {i}" for i in range(30)]
+    
+    async def scenario():
+        async with file_db() as session_factory:
+            store = await VectorStore.create(gemini_service)
+            try:
+                async with session_factory() as db:
+                    removed_chunks = await _store_document(db, removed_contents)
+                    await store.add_document_chunks(removed_chunks, db)
+                    kept_chunks = await _store_document(db, kept_contents)
+                    await store.add_document_chunks(kept_chunks, db)
+                    
+                    # Hold the rebuild until the removed vectors have been searched for
+                    build_index = store._build_index
+                    release = threading.Event()
+                    
+                    def held_build_index(vectors, chunk_ids):
+                        release.wait(timeout=10)
+                        return build_index(vectors, chunk_ids)
+                    
+                    monkeypatch.setattr(store, "_build_index", held_build_index)
+                    
+                    await store.remove_document_chunks(removed_chunks[0].document_id, db)
+                    # The graph is rebuilt in the background, not inside the delete
+                    compaction = store._compaction_task
+                    assert compaction is not None and not compaction.done()
+                    hidden = await store.search_by_embeddings(
+                        [fake_embedding(content) for content in removed_contents[:5]],
+                        k=5, similarity_threshold=-1.0, db=db
+                    )
+                    
+                    release.set()
+                    await compaction
+                    compacted = await store.search_by_embeddings(
+                        [fake_embedding(kept_contents[0])], k=1, similarity_threshold=-1.0, db=db
+                    )
+                    return removed_chunks, hidden, compacted, store.index.ntotal
+            finally:
+                await store.close()
+    
+    removed_chunks, hidden, compacted, ntotal = asyncio.run(scenario())
+    
+    removed_ids = {chunk.id for chunk in removed_chunks}
+    for results in hidden:
+        assert len(results) == 5
+        assert not removed_ids & {chunk.id for chunk, _ in results}
+    assert ntotal == len(kept_contents)
+    assert compacted[0][0][0].content == kept_contents[0]
+
+def test_index_saved_mid_compaction_keeps_removed_vectors_hidden(file_db, gemini_service, monkeypatch):
+    _use_settings(monkeypatch, VECTOR_INDEX_TYPE="hnsw", VECTOR_QUANTIZATION="none")
+    removed_contents = [f"removed chunk {i}" for i in range(20)]
+    kept_contents = [f"kept chunk {i}" for i in range(20)]
+    
+    async def scenario():
+        async with file_db() as session_factory:
+            store = await VectorStore.create(gemini_service)
+            release = threading.Event()
+            try:
+                async with session_factory() as db:
+                    removed_chunks = await _store_document(db, removed_contents)
+                    await store.add_document_chunks(removed_chunks, db)
+                    kept_chunks = await _store_document(db, kept_contents)
+                    await store.add_document_chunks(kept_chunks, db)
+                    
+                    # Keep the rebuild running while the index is saved
+                    build_index = store._build_index
+                    
+                    def held_build_index(vectors, chunk_ids):
+                        release.wait(timeout=10)
+                        return build_index(vectors, chunk_ids)
+                    
+                    monkeypatch.setattr(store, "_build_index", held_build_index)
+                    await store.remove_document_chunks(removed_chunks[0].document_id, db)
+                    await store._flush()
+                    
+                    # A restart before the rebuild finishes loads what was saved
+                    restarted = VectorStore(gemini_service)
+                    results = await restarted.search_by_embeddings(
+                        [fake_embedding(content) for content in removed_contents[:5]],
+                        k=5, similarity_threshold=-1.0, db=db
+                    )
+                    return removed_chunks, restarted.index.ntotal, results
+            finally:
+                release.set()
+                await store.close()
+    
+    removed_chunks, ntotal, results = asyncio.run(scenario())
+    
+    removed_ids = {chunk.id for chunk in removed_chunks}
+    assert ntotal == len(kept_contents)
+    for query_results in results:
+        assert len(query_results) == 5
+        assert not removed_ids & {chunk.id for chunk, _ in query_results}
+
+def test_failed_background_rebuild_falls_back_to_inline_rebuild(file_db, gemini_service, monkeypatch):
+    _use_settings(monkeypatch, VECTOR_INDEX_TYPE="hnsw", VECTOR_QUANTIZATION="none")
+    
+    async def scenario():
+        async with file_db() as session_factory:
+            store = await VectorStore.create(gemini_service)
+            try:
+                async with session_factory() as db:
+                    removed_chunks = await _store_document(db, ["removed one", "removed two"])
+                    await store.add_document_chunks(removed_chunks, db)
+                    kept_chunks = await _store_document(db, ["kept one", "kept two"])
+                    await store.add_document_chunks(kept_chunks, db)
+                    
+                    # Only the first rebuild fails
+                    build_index = store._build_index
+                    calls = []
+                    
+                    def failing_build_index(vectors, chunk_ids):
+                        calls.append(len(chunk_ids))
+                        if len(calls) == 1:
+                            raise MemoryError("out of memory")
+                        return build_index(vectors, chunk_ids)
+                    
+                    monkeypatch.setattr(store, "_build_index", failing_build_index)
+                    await store.remove_document_chunks(removed_chunks[0].document_id, db)
+                    await store._compaction_task
+                    return len(calls), len(store._removed_ids), store.index.ntotal
+            finally:
+                await store.close()
+    
+    calls, removed_count, ntotal = asyncio.run(scenario())
+    
+    assert calls == 2
+    assert removed_count == 0
+    assert ntotal == 2
+
+def test_query_embeddings_survive_cache_eviction(workdir, gemini_service, monkeypatch):
+    _use_settings(monkeypatch, QUERY_EMBEDDING_CACHE_SIZE=2)
+    store = VectorStore(gemini_service)
+    
+    async def scenario():
+        await store.get_query_embeddings(["cached one", "cached two"])
+        # The three new queries evict both cached ones before results are assembled
+        return await store.get_query_embeddings(["cached one", "new one", "new two", "cached two", "new three"])
+    
+    embeddings = asyncio.run(scenario())
+    
+    queries = ["cached one", "new one", "new two", "cached two", "new three"]
+    assert embeddings == [fake_embedding(query) for query in queries]
+
+@pytest.mark.parametrize("exact_search_max", [10_000, 0])
+def test_narrow_document_filter_returns_k_results(file_db, gemini_service, monkeypatch, exact_search_max):
+    _use_settings(
+        monkeypatch,
+        VECTOR_INDEX_TYPE="hnsw",
+        VECTOR_QUANTIZATION="none",
+        FILTERED_EXACT_SEARCH_MAX=exact_search_max
+    )
+    large_contents = [f"large document chunk {i}" for i in range(2000)]
+    small_contents = [f"small document chunk {i}" for i in range(8)]
+    query_embeddings = [fake_embedding(f"query {i}") for i in range(5)]
+    
+    async def scenario():
+        async with file_db() as session_factory:
+            store = await VectorStore.create(gemini_service)
+            try:
+                async with session_factory() as db:
+                    large_chunks = await _store_document(db, large_contents)
+                    await store.add_document_chunks(large_chunks, db)
+                    small_chunks = await _store_document(db, small_contents)
+                    await store.add_document_chunks(small_chunks, db)
+                    
+                    return small_chunks, await store.search_by_embeddings(
+                        query_embeddings,
+                        k=5,
+                        similarity_threshold=-1.0,
+                        document_ids=[small_chunks[0].document_id],
+                        db=db
+                    )
+            finally:
+                await store.close()
+    
+    small_chunks, results = asyncio.run(scenario())
+    
+    small_vectors = np.array([fake_embedding(content) for content in small_contents], dtype=np.float32)
+    faiss.normalize_L2(small_vectors)
+    for query_embedding, query_results in zip(query_embeddings, results):
+        query_vector = np.array([query_embedding], dtype=np.float32)
+        faiss.normalize_L2(query_vector)
+        expected = np.argsort(-(small_vectors @ query_vector[0]))[:5]
+        assert [chunk.id for chunk, _ in query_results] == [small_chunks[i].id for i in expected]
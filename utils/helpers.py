@@ -1,80 +1,197 @@
 import hashlib
 import re
 import logging
-from typing import List, Dict, Any, Optional
+import threading
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+from collections import Counter
 from datetime import datetime
-import json
+from functools import lru_cache
+from cachetools import LRUCache
+import orjson
 
 logger = logging.getLogger(__name__)
 
+# Patterns used by the helpers below, compiled once at import
+_WORD_RE = re.compile(r'\b[a-zA-Z]{3,}\b')
+_NON_SPACE_RE = re.compile(r'\S')
+_PARAGRAPH_BREAK_RE = re.compile(r'\n\n\s*\S')
+
+# Entities extracted by extract_metadata_from_text, keyed by metadata field
+_ENTITY_PATTERNS = {
+    "dates_found": r'\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b|\b\d{4}[/-]\d{1,2}[/-]\d{1,2}\b',
+    "emails_found": r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b',
+    "phones_found": r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b|\b\(\d{3}\)\s?\d{3}[-.]?\d{4}\b',
+}
+_ENTITY_LIMITS = {"dates_found": 5, "emails_found": 3, "phones_found": 3}
+
+@lru_cache(maxsize=None)
+def _entity_scanner(fields: Tuple[str, ...]) -> re.Pattern:
+    """Fuse entity patterns into one regex whose group names are the metadata fields"""
+    # ASCII \d, \s and \b, the same classes Hyperscan uses, so its prefilter is exact
+    return re.compile('|'.join(f'(?P<{field}>{_ENTITY_PATTERNS[field]})' for field in fields), re.ASCII)
+
+@lru_cache(maxsize=None)
+def _hyperscan_database():
+    """Compile the entity patterns for Hyperscan, or return None when it is not installed"""
+    try:
+        import hyperscan
+    except ImportError:
+        return None
+    
+    database = hyperscan.Database()
+    try:
+        database.compile(
+            expressions=[pattern.encode('ascii') for pattern in _ENTITY_PATTERNS.values()],
+            ids=list(range(len(_ENTITY_PATTERNS))),
+            # Report each pattern once. UCP mode can't compile \b, so character
+            # classes stay ASCII, matching the re.ASCII scanner
+            flags=[hyperscan.HS_FLAG_SINGLEMATCH | hyperscan.HS_FLAG_UTF8] * len(_ENTITY_PATTERNS)
+        )
+    except hyperscan.error as e:
+        logger.warning(f"Hyperscan could not compile entity patterns, using re only: {str(e)}")
+        return None
+    return database
+
+_hyperscan_lock = threading.Lock()  # Scans share the database's scratch space
+
+def _entity_fields(text: str) -> Tuple[str, ...]:
+    """Metadata fields whose entity pattern may occur in text"""
+    database = _hyperscan_database()
+    if database is not None:
+        try:
+            data = text.encode('utf-8')
+        except UnicodeEncodeError:
+            data = None
+        
+        if data is not None:
+            found = set()
+            
+            def on_match(pattern_id, start, end, flags, context):
+                found.add(pattern_id)
+                # Stop scanning once every pattern has matched
+                return len(found) == len(_ENTITY_PATTERNS)
+            
+            import hyperscan
+            with _hyperscan_lock:
+                try:
+                    database.scan(data, match_event_handler=on_match)
+                except hyperscan.ScanTerminated:
+                    pass  # Raised when on_match stops the scan early
+            return tuple(field for i, field in enumerate(_ENTITY_PATTERNS) if i in found)
+    
+    # Text without an '@' cannot hold an email, so skip that branch entirely
+    if '@' not in text:
+        return ("dates_found", "phones_found")
+    return tuple(_ENTITY_PATTERNS)
+
+# Common words ignored by extract_keywords
+_STOP_WORDS = frozenset({
+    'the', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with',
+    'by', 'from', 'up', 'about', 'into', 'through', 'during', 'before',
+    'after', 'above', 'below', 'between', 'among', 'this', 'that', 'these',
+    'those', 'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have',
+    'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could', 'should',
+    'may', 'might', 'must', 'can', 'shall'
+})
+
+# Folds sentence terminators into '.' so sentences split with str.split
+_SENTENCE_END_TABLE = str.maketrans('!?', '..')
+
+_SIZE_UNITS = ("B", "KB", "MB", "GB", "TB")
+_SIZE_DIVISORS = tuple(1024 ** i for i in range(len(_SIZE_UNITS)))
+
+# Results of extract_keywords and extract_metadata_from_text keyed by content hash
+_ANALYSIS_CACHE_SIZE = 1024
+_keyword_cache = LRUCache(maxsize=_ANALYSIS_CACHE_SIZE)
+_metadata_cache = LRUCache(maxsize=_ANALYSIS_CACHE_SIZE)
+_analysis_cache_lock = threading.Lock()
+
+_HASH_BLOCK_CHARS = 64 * 1024  # Characters encoded per update when hashing large content
+
+# Replaces path separators and characters unsafe in filenames with '_'
+_FILENAME_TABLE = str.maketrans(dict.fromkeys('<>:"/\\|?*', '_'))
+
+_KEPT_PUNCTUATION = frozenset(".,!?;:()-'\"")
+
+class _CleanTextTable(dict):
+    """str.translate table that drops everything but word characters, whitespace and basic punctuation.
+
+    Codepoints are classified the first time they are seen, so the table only
+    ever holds characters that actually occur in processed text.
+    """
+    
+    def __missing__(self, codepoint: int) -> Optional[int]:
+        char = chr(codepoint)
+        keep = char.isalnum() or char == '_' or char.isspace() or char in _KEPT_PUNCTUATION
+        value = codepoint if keep else None
+        self[codepoint] = value
+        return value
+
+_CLEAN_TEXT_TABLE = _CleanTextTable()
+
 def generate_hash(content: str) -> str:
-    """Generate MD5 hash for content"""
-    return hashlib.md5(content.encode('utf-8')).hexdigest()
+    """Generate a 128-bit BLAKE2b hash for content"""
+    if len(content) <= _HASH_BLOCK_CHARS:
+        return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+    
+    # Encode large content a block at a time so only one block's bytes are held at once
+    digest = hashlib.blake2b(digest_size=16)
+    for start in range(0, len(content), _HASH_BLOCK_CHARS):
+        digest.update(content[start:start + _HASH_BLOCK_CHARS].encode('utf-8'))
+    return digest.hexdigest()
+
+def query_hash(query: str) -> str:
+    """Hash a search query for cache keys, ignoring case and whitespace differences"""
+    return generate_hash(" ".join(query.lower().split()))
 
 def clean_text(text: str) -> str:
     """Clean and normalize text content"""
     if not text:
         return ""
     
-    # Remove extra whitespace
-    text = re.sub(r'\s+', ' ', text)
-    
     # Remove special characters but keep basic punctuation
-    text = re.sub(r'[^\w\s.,!?;:()\-\'""]', '', text)
+    text = text.translate(_CLEAN_TEXT_TABLE)
     
-    # Strip leading/trailing whitespace
-    text = text.strip()
-    
-    return text
+    # Collapse whitespace runs and strip leading/trailing whitespace
+    return ' '.join(text.split())
 
 def extract_keywords(text: str, max_keywords: int = 10) -> List[str]:
     """Extract keywords from text (simple implementation)"""
     if not text:
         return []
     
-    # Convert to lowercase and split into words
-    words = re.findall(r'\b[a-zA-Z]{3,}\b', text.lower())
-    
-    # Remove common stop words
-    stop_words = {
-        'the', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with',
-        'by', 'from', 'up', 'about', 'into', 'through', 'during', 'before',
-        'after', 'above', 'below', 'between', 'among', 'this', 'that', 'these',
-        'those', 'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have',
-        'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could', 'should',
-        'may', 'might', 'must', 'can', 'shall'
-    }
-    
-    # Filter out stop words and count frequency
-    word_freq = {}
-    for word in words:
-        if word not in stop_words and len(word) > 3:
-            word_freq[word] = word_freq.get(word, 0) + 1
+    key = (generate_hash(text), max_keywords)
+    with _analysis_cache_lock:
+        keywords = _keyword_cache.get(key)
+    if keywords is None:
+        keywords = tuple(_extract_keywords(text, max_keywords))
+        with _analysis_cache_lock:
+            _keyword_cache[key] = keywords
+    return list(keywords)
+
+def _extract_keywords(text: str, max_keywords: int) -> List[str]:
+    """Count non-stop-words in text and return the most frequent"""
+    # Filter out stop words and count frequency in a single pass
+    word_freq = Counter(word for word in _WORD_RE.findall(text.lower()) if word not in _STOP_WORDS)
     
-    # Sort by frequency and return top keywords
-    keywords = sorted(word_freq.items(), key=lambda x: x[1], reverse=True)
-    return [word for word, freq in keywords[:max_keywords]]
+    # most_common selects the top keywords with a heap rather than a full sort
+    return [word for word, freq in word_freq.most_common(max_keywords)]
 
 def format_file_size(size_bytes: int) -> str:
     """Format file size in human readable format"""
     if size_bytes == 0:
         return "0 B"
     
-    size_names = ["B", "KB", "MB", "GB", "TB"]
-    i = 0
-    while size_bytes >= 1024 and i < len(size_names) - 1:
-        size_bytes /= 1024.0
-        i += 1
-    
-    return f"{size_bytes:.1f} {size_names[i]}"
+    # Each unit spans 10 bits, so the bit length picks the unit without a division loop
+    i = min((size_bytes.bit_length() - 1) // 10, len(_SIZE_UNITS) - 1)
+    return "%.1f %s" % (size_bytes / _SIZE_DIVISORS[i], _SIZE_UNITS[i])
 
-def validate_file_type(filename: str, allowed_types: List[str]) -> bool:
+def validate_file_type(filename: str, allowed_types: Iterable[str]) -> bool:
     """Validate if file type is allowed"""
     if not filename:
         return False
     
-    file_extension = f".{filename.split('.')[-1].lower()}"
-    return file_extension in allowed_types
+    return filename.lower().endswith(tuple(allowed_types))
 
 def sanitize_filename(filename: str) -> str:
     """Sanitize filename for safe storage"""
@@ -82,7 +199,7 @@ def sanitize_filename(filename: str) -> str:
         return "unnamed_file"
     
     # Remove path separators and dangerous characters
-    filename = re.sub(r'[<>:"/\\|?*]', '_', filename)
+    filename = filename.translate(_FILENAME_TABLE)
     
     # Remove leading/trailing dots and spaces
     filename = filename.strip('. ')
@@ -93,19 +210,30 @@ def sanitize_filename(filename: str) -> str:
     
     return filename
 
-def create_error_response(error: str, message: str, request_id: Optional[str] = None) -> Dict[str, Any]:
-    """Create standardized error response"""
+def create_error_response(
+    error: str,
+    message: str,
+    request_id: Optional[str] = None,
+    timestamp: Optional[str] = None
+) -> Dict[str, Any]:
+    """Create standardized error response; pass timestamp to share one across a batch of errors"""
     return {
         "error": error,
         "message": message,
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": timestamp or datetime.now().isoformat(),
         "request_id": request_id
     }
 
 def log_performance(func_name: str, execution_time: float, **kwargs):
     """Log performance metrics"""
+    # Skip building the message and extra fields when INFO is filtered out
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    
     logger.info(
-        f"Performance: {func_name} executed in {execution_time:.3f}s",
+        "Performance: %s executed in %.3fs",
+        func_name,
+        execution_time,
         extra={
             "function": func_name,
             "execution_time": execution_time,
@@ -118,70 +246,107 @@ def chunk_text_by_sentences(text: str, max_chunk_size: int = 1000, overlap: int
     if not text:
         return []
     
-    # Split into sentences
-    sentences = re.split(r'[.!?]+', text)
-    sentences = [s.strip() for s in sentences if s.strip()]
+    sentences = _split_sentences(text)
     
+    # Accumulate sentences in a list and join once per chunk
     chunks = []
-    current_chunk = ""
+    parts: List[str] = []
+    length = 0  # Length of " ".join(parts)
+    overlap_words = overlap // 10  # Approximate word overlap
     
     for sentence in sentences:
-        # Check if adding this sentence would exceed chunk size
-        if len(current_chunk) + len(sentence) + 1 > max_chunk_size:
-            if current_chunk:
-                chunks.append(current_chunk.strip())
-                
-                # Create overlap for next chunk
-                words = current_chunk.split()
-                if len(words) > overlap // 10:  # Approximate word overlap
-                    overlap_text = " ".join(words[-(overlap // 10):])
-                    current_chunk = overlap_text + " " + sentence
-                else:
-                    current_chunk = sentence
-            else:
-                current_chunk = sentence
+        if not parts:
+            parts.append(sentence)
+            length = len(sentence)
+        elif length + len(sentence) + 1 > max_chunk_size:
+            # Adding this sentence would exceed chunk size
+            chunks.append(" ".join(parts))
+            
+            # Create overlap for next chunk
+            parts = _tail_words(parts, overlap_words) if overlap_words else []
+            parts.append(sentence)
+            length = sum(map(len, parts)) + len(parts) - 1
         else:
-            current_chunk += " " + sentence if current_chunk else sentence
+            parts.append(sentence)
+            length += len(sentence) + 1
     
     # Add the last chunk
-    if current_chunk:
-        chunks.append(current_chunk.strip())
+    if parts:
+        chunks.append(" ".join(parts))
     
     return chunks
 
+def _split_sentences(text: str) -> List[str]:
+    """Split text on runs of '.', '!' and '?' into stripped, non-empty sentences"""
+    sentences = text.translate(_SENTENCE_END_TABLE).split('.')
+    return [s.strip() for s in sentences if s and not s.isspace()]
+
+def _count_paragraphs(text: str) -> int:
+    """Count non-blank blocks separated by blank lines without splitting the text"""
+    if '\n\n' not in text:
+        return 1 if text and not text.isspace() else 0
+    
+    first = _NON_SPACE_RE.search(text)
+    if first is None:
+        return 0
+    # Each paragraph after the first starts past a whitespace run holding a blank line
+    return 1 + sum(1 for _ in _PARAGRAPH_BREAK_RE.finditer(text, first.start()))
+
+def _tail_words(parts: List[str], count: int) -> List[str]:
+    """Return the last count words of the joined parts, or none if there are no more than count"""
+    words: List[str] = []
+    for part in reversed(parts):
+        words[:0] = part.split()
+        if len(words) > count:
+            return words[-count:]
+    return []
+
 def extract_metadata_from_text(text: str) -> Dict[str, Any]:
     """Extract metadata from text content"""
-    metadata = {}
-    
     if not text:
-        return metadata
+        return {}
+    
+    key = generate_hash(text)
+    with _analysis_cache_lock:
+        metadata = _metadata_cache.get(key)
+    if metadata is None:
+        metadata = _extract_metadata(text)
+        with _analysis_cache_lock:
+            _metadata_cache[key] = metadata
+    
+    # Copy so callers cannot mutate the cached entry
+    return {field: list(value) if isinstance(value, list) else value for field, value in metadata.items()}
+
+def _extract_metadata(text: str) -> Dict[str, Any]:
+    """Compute statistics, entities and keywords for non-empty text"""
+    metadata = {}
     
     # Basic statistics
     metadata["character_count"] = len(text)
     metadata["word_count"] = len(text.split())
-    metadata["sentence_count"] = len(re.split(r'[.!?]+', text))
-    metadata["paragraph_count"] = len([p for p in text.split('\n\n') if p.strip()])
-    
-    # Extract potential dates
-    date_pattern = r'\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b|\b\d{4}[/-]\d{1,2}[/-]\d{1,2}\b'
-    dates = re.findall(date_pattern, text)
-    if dates:
-        metadata["dates_found"] = dates[:5]  # Limit to first 5 dates
-    
-    # Extract potential email addresses
-    email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-    emails = re.findall(email_pattern, text)
-    if emails:
-        metadata["emails_found"] = emails[:3]  # Limit to first 3 emails
-    
-    # Extract potential phone numbers
-    phone_pattern = r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b|\b\(\d{3}\)\s?\d{3}[-.]?\d{4}\b'
-    phones = re.findall(phone_pattern, text)
-    if phones:
-        metadata["phones_found"] = phones[:3]  # Limit to first 3 phones
+    metadata["sentence_count"] = len(_split_sentences(text))
+    metadata["paragraph_count"] = _count_paragraphs(text)
+    
+    # Extract potential dates, email addresses and phone numbers in a single scan
+    # Hyperscan (when installed) first finds which entity types occur at all,
+    # so re only runs for those and is skipped entirely when none do
+    fields = _entity_fields(text)
+    entities = {kind: [] for kind in _ENTITY_LIMITS}
+    remaining = sum(_ENTITY_LIMITS[kind] for kind in fields)
+    for match in (_entity_scanner(fields).finditer(text) if fields else ()):
+        found = entities[match.lastgroup]
+        if len(found) < _ENTITY_LIMITS[match.lastgroup]:
+            found.append(match.group())
+            remaining -= 1
+            if not remaining:
+                break
+    
+    for kind, found in entities.items():
+        if found:
+            metadata[kind] = found
     
     # Extract keywords
-    keywords = extract_keywords(text, max_keywords=5)
+    keywords = _extract_keywords(text, max_keywords=5)
     if keywords:
         metadata["keywords"] = keywords
     
@@ -190,13 +355,14 @@ def extract_metadata_from_text(text: str) -> Dict[str, Any]:
 def safe_json_loads(json_str: str, default: Any = None) -> Any:
     """Safely load JSON string with fallback"""
     try:
-        return json.loads(json_str)
-    except (json.JSONDecodeError, TypeError):
+        return orjson.loads(json_str)
+    except (orjson.JSONDecodeError, TypeError):
         return default
 
 def safe_json_dumps(obj: Any, default: str = "{}") -> str:
     """Safely dump object to JSON string with fallback"""
     try:
-        return json.dumps(obj, default=str)
-    except (TypeError, ValueError):
+        # Non-string keys are coerced like the stdlib json module does
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    except (orjson.JSONEncodeError, ValueError):
         return default 
\ No newline at end of file